@@ -4,10 +4,8 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 import secrets
 import logging
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
+from app.utils.encryption import encrypt_data, decrypt_data
+from app.utils.keys import load_keys
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql://root:@localhost/alchemy'
@@ -26,16 +24,8 @@ app.secret_key = secrets.token_hex(16)
 
 API_KEY = 'kabirhere'  # Replace with your actual API key
 
-def generate_rsa_keys():
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048,
-        backend=default_backend()
-    )
-    public_key = private_key.public_key()
-    return private_key, public_key
-
-private_key, public_key = generate_rsa_keys()
+# Load the RSA key pair written by generate_keys.py
+private_key, public_key = load_keys()
 
 # Database Models
 class User(db.Model):
@@ -91,36 +81,6 @@ def authenticate():
         abort(401, description="Unauthorized")
     return "API Key is verified"
 
-# Function to encrypt data with RSA public key
-def encrypt_data(data, public_key):
-    encrypted_data = public_key.encrypt(
-        data.encode(),
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
-        )
-    )
-    return encrypted_data
-
-# Function to decrypt data with RSA private key
-def decrypt_data(encrypted_data, private_key):
-    try:
-        decrypted_data = private_key.decrypt(
-            encrypted_data,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        return decrypted_data
-    except Exception as e:
-        logger.error(f"Decryption error: {str(e)}")
-        raise  # Re-raise the exception to propagate the error up
-
-
-
 @app.route("/")
 def home_route():
     return "Home Route!"
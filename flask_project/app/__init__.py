@@ -4,6 +4,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 import logging
+import os
 
 # Initialize Flask extensions
 db = SQLAlchemy()
@@ -12,21 +13,108 @@ ma = Marshmallow()
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Project root, where generate_keys.py writes the key pair
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 # Configuration class
 class Config:
     SQLALCHEMY_DATABASE_URI = 'mysql://root:@localhost/alchemy'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = 'kabirhere'
+    BLIND_INDEX_KEY = 'kabirhere-grade-index'
+    # Keyset pagination for the list endpoints; larger ?limit= values are capped
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+    # Rows per server-side cursor fetch when streaming NDJSON (?format=ndjson)
+    STREAM_BATCH_SIZE = 500
+    # Multi-get endpoints: ids per IN (...) query and ids per request
+    IN_CLAUSE_CHUNK_SIZE = 500
+    MAX_MULTI_GET_IDS = 10000
+    # Bulk endpoints: rows per insert-and-commit chunk and items per request
+    BULK_CHUNK_SIZE = 1000
+    MAX_BULK_ITEMS = 10000
+    # Process-wide cache of decrypted grades, keyed by a digest of the ciphertext
+    GRADE_CACHE_MAX_ENTRIES = 50000
+    GRADE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+    GRADE_CACHE_TTL = 300
+    # Response cache for the read endpoints: in-process L1 bounds and TTL, and an optional
+    # SQLite file shared by every worker on the host as L2 (None disables it)
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_MAX_ENTRIES = 1000
+    RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    RESPONSE_CACHE_TTL = 60
+    RESPONSE_CACHE_L2_PATH = None
+    RESPONSE_CACHE_L2_TTL = 300
+    # Rows each table's change counter (behind the ETags) is spread over, to keep writers off one row lock
+    TABLE_VERSION_SHARDS = 16
+    # Seconds /get_user_stats reuses a computed result (0 recomputes on every request)
+    STATS_CACHE_TTL = 30
+    # JSON encoding: 'fast' (orjson when installed, stdlib json otherwise) or Flask's 'default'
+    JSON_PROVIDER = 'fast'
+    # API keys of trusted clients that encrypt and decrypt grades themselves
+    PASSTHROUGH_API_KEYS = []
+    PRIVATE_KEY_PATH = os.path.join(basedir, 'private_key.pem')
+    PUBLIC_KEY_PATH = os.path.join(basedir, 'public_key.pem')
+    # Cipher suite for new grades: 'rsa-oaep', 'rsa-aes-gcm' or 'x25519-aes-gcm'.
+    # The key pair at PRIVATE_KEY_PATH/PUBLIC_KEY_PATH must be of the matching type.
+    CIPHER_SUITE = 'rsa-aes-gcm'
+    # Private keys of rotated-out pairs, kept so older rows still decrypt
+    RETIRED_PRIVATE_KEY_PATHS = []
+    REENCRYPT_CHECKPOINT_PATH = os.path.join(basedir, 'reencrypt.checkpoint')
+    # Unix socket of the crypto service (python -m app.utils.crypto_service); None decrypts in-process
+    CRYPTO_SERVICE_SOCKET = None
+    CRYPTO_SERVICE_TIMEOUT = 5.0
 
 # Function to create the Flask application
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    from app.utils.json_provider import get_json_provider_class
+    app.json = get_json_provider_class(app.config['JSON_PROVIDER'])(app)
+
     # Initialize extensions with the app context
     db.init_app(app)
     ma.init_app(app)
 
+    # Bounds and TTL of the decrypted grade cache
+    from app.utils.grade_cache import grade_cache
+    grade_cache.configure(app.config)
+
+    # Load the key pairs once, before any workers are forked
+    from app.utils import encryption
+    from app.utils.keys import load_keys, get_public_key
+    encryption.CIPHER_SUITE = encryption.get_cipher_suite(app.config['CIPHER_SUITE']).name
+    crypto_service = None
+    if app.config['CRYPTO_SERVICE_SOCKET']:
+        from app.utils.crypto_service import CryptoServiceClient
+        crypto_service = CryptoServiceClient(app.config['CRYPTO_SERVICE_SOCKET'], app.config['CRYPTO_SERVICE_TIMEOUT'])
+    load_keys(
+        app.config['PRIVATE_KEY_PATH'],
+        app.config['PUBLIC_KEY_PATH'],
+        retired_key_paths=app.config['RETIRED_PRIVATE_KEY_PATHS'],
+        crypto_service=crypto_service
+    )
+    if not isinstance(get_public_key(), encryption.get_cipher_suite().public_key_type):
+        raise ValueError(f"The active key pair cannot be used with cipher suite {encryption.CIPHER_SUITE}")
+
+    # A newly minted data key is only reused once the transaction that stored it commits
+    encryption.track_data_keys(db.session)
+    # Keep the per-table change counters behind the read endpoints' ETags current
+    from app.utils.etags import track_table_versions
+    track_table_versions(db.session)
+    # Cached read responses are dropped as soon as a write to a table they read commits
+    from app.utils.response_cache import response_cache, invalidate_on_commit
+    response_cache.configure(app.config)
+    invalidate_on_commit(db.session)
+
+    # Register CLI commands
+    from app.utils.rotation import reencrypt_grades_command, backfill_grade_index_command
+    app.cli.add_command(reencrypt_grades_command)
+    app.cli.add_command(backfill_grade_index_command)
+    from app.utils.grade_stats import rebuild_grade_stats_command
+    app.cli.add_command(rebuild_grade_stats_command)
+
     # Register blueprints
     from app.routes import users_bp, subjects_bp  # Import blueprints
     app.register_blueprint(users_bp)
@@ -3,12 +3,28 @@
 from app import db
 
 class User(db.Model):
+    __table_args__ = (
+        # One row per (name, age, gender); create paths upsert against this index
+        db.Index('uq_user_name_age_gender', 'name', 'age', 'gender', unique=True),
+        # Listing filters and sorts. Keyset pages order by (sort column, id), so sort=name needs id right
+        # after name; the other single-column indexes end in the primary key implicitly.
+        db.Index('ix_user_name_id', 'name', 'id'),
+        db.Index('ix_user_age', 'age'),
+        db.Index('ix_user_gender_age', 'gender', 'age'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(20), nullable=False)
     age = db.Column(db.Integer, nullable=False)
     gender = db.Column(db.String(10), nullable=False)
 
-    subjects = db.relationship('Subject', backref='user', lazy=True)
+    # Lazy loads raise, so every query has to pick its loader strategy (joinedload/selectinload)
+    subjects = db.relationship(
+        'Subject',
+        backref=db.backref('user', lazy='raise_on_sql'),
+        lazy='raise_on_sql',
+        order_by='Subject.subject_id'
+    )
 
     def __init__(self, name, age, gender):
         self.name = name
@@ -16,12 +32,78 @@ class User(db.Model):
         self.gender = gender
 
 class Subject(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+    __tablename__ = 'subject'
+    # A user has each subject at most once; add_subject upserts against this index
+    __table_args__ = (db.Index('uq_subject_name_user', 'subject_name', 'user_id', unique=True),)
+
+    subject_id = db.Column(db.Integer, primary_key=True)
     subject_name = db.Column(db.String(50), nullable=False)
     encrypted_grade = db.Column(db.LargeBinary, nullable=False)
+    # Id of the key pair the grade was encrypted under (NULL for rows written before key ids)
+    key_id = db.Column(db.String(16), nullable=True, index=True)
+    # HMAC of the plaintext grade, lets queries filter by grade without decrypting
+    grade_index = db.Column(db.String(32), nullable=True, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
-    def __init__(self, subject_name, encrypted_grade, user_id):
+    def __init__(self, subject_name, encrypted_grade, user_id, key_id=None, grade_index=None):
         self.subject_name = subject_name
         self.encrypted_grade = encrypted_grade
         self.user_id = user_id
+        self.key_id = key_id
+        self.grade_index = grade_index
+
+# AES data keys of the rsa-aes-gcm suite, wrapped by the RSA public key. Ciphertexts carry the
+# key id (hex here), so every process and host that can reach the database can decrypt them.
+class DataKey(db.Model):
+    __tablename__ = 'data_key'
+    id = db.Column(db.String(16), primary_key=True)
+    wrapped_key = db.Column(db.LargeBinary, nullable=False)
+    public_key_fingerprint = db.Column(db.String(64), nullable=False, index=True)
+
+    def __init__(self, id, wrapped_key, public_key_fingerprint):
+        self.id = id
+        self.wrapped_key = wrapped_key
+        self.public_key_fingerprint = public_key_fingerprint
+
+# Grade counts maintained at write time, so reporting never has to decrypt subject rows.
+# Rows are keyed by the grade blind index; the grade label is stored alongside for display.
+class SubjectGradeStat(db.Model):
+    __tablename__ = 'subject_grade_stat'
+    subject_name = db.Column(db.String(50), primary_key=True)
+    grade_index = db.Column(db.String(32), primary_key=True)
+    grade = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, subject_name, grade_index, grade, count=0):
+        self.subject_name = subject_name
+        self.grade_index = grade_index
+        self.grade = grade
+        self.count = count
+
+class UserGradeStat(db.Model):
+    __tablename__ = 'user_grade_stat'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    grade_index = db.Column(db.String(32), primary_key=True)
+    grade = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, user_id, grade_index, grade, count=0):
+        self.user_id = user_id
+        self.grade_index = grade_index
+        self.grade = grade
+        self.count = count
+
+# Change counter per table, bumped in the same transaction as every write to it.
+# Read endpoints derive their ETags from it, so unchanged polls are answered without touching the rows.
+# Each table's counter is split over several shard rows, each writer bumping a random one, so concurrent
+# writers rarely wait on the same row lock; the table's version is the sum of its shards.
+class TableVersion(db.Model):
+    __tablename__ = 'table_version'
+    table_name = db.Column(db.String(64), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False, default=0)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __init__(self, table_name, shard=0, version=0):
+        self.table_name = table_name
+        self.shard = shard
+        self.version = version
@@ -1,9 +1,22 @@
-from flask import Blueprint, request, jsonify, abort, Flask
+from flask import Blueprint, request, jsonify, abort, Flask, current_app
 from ..models import Subject
 from ..schemas import subject_schema, subjects_schema
-from ..utils.auth import authenticate
-from ..utils.encryption import encrypt_data, decrypt_data
+from ..serializers import compile_serializer, row_layout
+from ..utils.auth import authenticate, is_passthrough_client
+from ..utils.encryption import encrypt_data, decrypt_data, decrypt_many, blind_index, encode_ciphertext, decode_ciphertext, check_client_ciphertext, get_wrapped_data_keys, KEY_ID_SIZE
+from ..utils.grade_cache import grade_cache
+from ..utils.grade_stats import record_grade, get_subject_grade_stats, get_user_grade_stats
+from ..utils.pagination import paginate, with_next_cursor
+from ..utils.streaming import wants_ndjson, stream_ndjson
+from ..utils.batching import chunked, parse_id_list, MAX_MULTI_GET_IDS
+from ..utils.upsert import insert_or_get
+from ..utils.etags import make_etag, not_modified, with_etag
+from ..utils.response_cache import response_cache, cached_response, cache_response, partial_response
+from ..utils.fields import get_fields
+from ..utils.keys import get_private_key, get_public_key, get_active_key_id, get_key_ids
 from .. import db
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
 import logging
 
 
@@ -22,83 +35,310 @@ def add_subject():
             abort(400, description="Missing subject data")
         
         # Validate subject data
-        validate_subject_data(subject_data)
+        passthrough = is_passthrough_client()
+        validate_subject_data(subject_data, passthrough)
         
-        # Check if the subject already exists for the user
-        existing_subject = Subject.query.filter_by(
-            subject_name=subject_data["subject_name"],
-            user_id=subject_data["user_id"]
-        ).first()
+        if passthrough:
+            # The client already encrypted the grade; without the plaintext there is no blind index or stats entry
+            grade = None
+            values = {
+                "subject_name": subject_data["subject_name"],
+                "encrypted_grade": decode_ciphertext(subject_data["encrypted_grade"]),
+                "user_id": subject_data["user_id"],
+                "key_id": passthrough_key_id(subject_data)
+            }
+            check_client_ciphertext(values["encrypted_grade"], get_public_key(values["key_id"]))
+        else:
+            # Encrypt grade under the active key pair
+            grade = subject_data["grade"]
+            key_id = get_active_key_id()
+            values = {
+                "subject_name": subject_data["subject_name"],
+                "encrypted_grade": encrypt_data(grade, get_public_key(key_id)),
+                "user_id": subject_data["user_id"],
+                "key_id": key_id,
+                "grade_index": blind_index(grade, current_app.config["BLIND_INDEX_KEY"])
+            }
         
-        if existing_subject:
+        # Insert unless the user already has this subject, in one statement on the unique index
+        subject_id, created = insert_or_get(Subject, values, ("subject_name", "user_id"))
+        if not created:
             return jsonify({
                 "message": "Subject already exists for this user",
-                "subject_id": existing_subject.subject_id
+                "subject_id": subject_id
             })
         
-        # Encrypt grade using RSA public key
-        grade = subject_data["grade"]
-        encrypted_grade = encrypt_data(grade, public_key)
-        
-        # Create new subject and add to database
-        new_subject = Subject(
-            subject_name=subject_data["subject_name"],
-            encrypted_grade=encrypted_grade,
-            user_id=subject_data["user_id"]
-        )
-        db.session.add(new_subject)
+        if grade is not None:
+            grade_cache.put(values["encrypted_grade"], grade.encode())  # First read of this row needs no decryption
+            record_grade(values["subject_name"], values["user_id"], values["grade_index"], grade)
         db.session.commit()
         
-        logger.info(f"Subject added: {new_subject}")
+        logger.info(f"Subject added: {subject_id}")
         
-        return jsonify({"subject_id": new_subject.subject_id})
+        return jsonify({"subject_id": subject_id})
     
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error adding subject: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-def validate_subject_data(subject_data):
+def validate_subject_data(subject_data, passthrough=False):
     # Validating subject name
     if not isinstance(subject_data.get("subject_name"), str) or not subject_data.get("subject_name").strip():
         abort(400, description="Invalid subject name. Subject name must be a non-empty string.")
     
     # Validating grade
-    if not isinstance(subject_data.get("grade"), str) or not subject_data.get("grade").strip():
+    if passthrough:
+        try:
+            if not decode_ciphertext(subject_data.get("encrypted_grade") or ""):
+                raise ValueError
+        except (ValueError, TypeError):
+            abort(400, description="Invalid encrypted grade. Encrypted grade must be non-empty base64.")
+    elif not isinstance(subject_data.get("grade"), str) or not subject_data.get("grade").strip():
         abort(400, description="Invalid grade. Grade must be a non-empty string.")
     
     # Validating user_id
     if not isinstance(subject_data.get("user_id"), int) or subject_data.get("user_id") <= 0:
         abort(400, description="Invalid user ID. User ID must be a positive integer.")
 
+def passthrough_key_id(subject_data):
+    # Key pair a client-encrypted grade was written under; every later read resolves it, so it must be registered
+    key_id = subject_data.get("key_id") or get_active_key_id()
+    if not isinstance(key_id, str) or key_id not in get_key_ids():
+        raise ValueError(f"Unknown key id: {key_id}")
+    return key_id
+
+
+
+# Fields a subject read can return; trusted clients get the ciphertext instead of the grade.
+# Envelope ciphertexts name their data key in the header, fetched once per id from /get_data_keys.
+SUBJECT_FIELDS = ("subject_id", "subject_name", "grade")
+PASSTHROUGH_SUBJECT_FIELDS = ("subject_id", "subject_name", "encrypted_grade", "key_id")
+
+def subject_columns(fields):
+    # Narrowest column list that serves fields; the primary key is always loaded for pagination
+    columns = {"subject_id": Subject.subject_id}
+    for field in fields:
+        if field == "grade":
+            # Decryption needs the key id to pick the private key
+            columns["encrypted_grade"] = Subject.encrypted_grade
+            columns["key_id"] = Subject.key_id
+        else:
+            columns[field] = getattr(Subject, field)
+    return list(columns.values())
+
+def serialize_subjects(subjects, passthrough=False, include_user_id=False, fields=None):
+    # Returns the serialized subjects and the ids of those left out because their grade could not be read
+    fields = tuple(fields or (PASSTHROUGH_SUBJECT_FIELDS if passthrough else SUBJECT_FIELDS))
+    if include_user_id:
+        fields += ("user_id",)
+    serialize = compile_serializer(fields, row_layout(subjects))
+    if "grade" not in fields:
+        return serialize(subjects), []
+    
+    # Decrypt all grades in one batch, and only when the grade was asked for
+    decrypted_grades = decrypt_many(
+        [subject.encrypted_grade for subject in subjects],
+        get_private_key,
+        key_ids=[subject.key_id for subject in subjects]
+    )
+    grades = []
+    failed = []
+    for subject, decrypted_grade in zip(subjects, decrypted_grades):
+        try:
+            if isinstance(decrypted_grade, Exception):
+                raise decrypted_grade
+            grades.append(decrypted_grade.decode('utf-8'))
+        except Exception as e:
+            logger.error(f"Error decrypting grade for subject ID {subject.subject_id}: {str(e)}")
+            grades.append(e)
+            failed.append(subject.subject_id)
+    # Rows that failed to decrypt or decode are left out
+    return serialize(subjects, grades), failed
+
 
 @app.route("/get_subject_info", methods=["GET"])
 def get_subject_info():
     try:
         authenticate()  # Ensure the request is authenticated
+        passthrough = is_passthrough_client()
+        ndjson = wants_ndjson()
+        fields = get_fields(PASSTHROUGH_SUBJECT_FIELDS if passthrough else SUBJECT_FIELDS)
+        columns = subject_columns(fields or (PASSTHROUGH_SUBJECT_FIELDS if passthrough else SUBJECT_FIELDS))
+        
+        # Unchanged since the client's copy: answer before reading or decrypting any rows
+        etag = make_etag("get_subject_info", (Subject,), request.args.to_dict(), ndjson, passthrough)
+        if response := not_modified(etag):
+            return response
         
-        # Query all subjects
-        subjects = Subject.query.all()
-        
-        # Prepare result with decrypted grades
-        result = []
-        for subject in subjects:
-            try:
-                decrypted_grade = decrypt_data(subject.encrypted_grade, private_key)
-                subject_dict = {
-                    "subject_id": subject.subject_id,
-                    "subject_name": subject.subject_name,
-                    "grade": decrypted_grade.decode('utf-8')  # Convert bytes to UTF-8 string
-                }
-                result.append(subject_dict)
-            except Exception as e:
-                logger.error(f"Error decrypting grade for subject ID {subject.subject_id}: {str(e)}")
-                continue
+        # Stream the whole table, decrypting one batch at a time
+        if ndjson:
+            statement = select(*columns).order_by(Subject.subject_id)
+            def serialize_batch(subjects):
+                result, failed = serialize_subjects(subjects, passthrough, fields=fields)
+                return result, len(failed)
+            # Rows left out end the stream with an error line, which clients must not keep or revalidate
+            return with_etag(stream_ndjson(statement, serialize_batch), etag)
+        
+        # Same ETag, same body: reuse the one already built
+        if response := cached_response(etag):
+            return response
+        
+        # Query one page of subjects, loading only the requested columns
+        subjects, next_cursor = paginate(Subject.query.options(load_only(*columns)), Subject.subject_id, "subjects")
+        result, failed = serialize_subjects(subjects, passthrough, fields=fields)
         
         # Log the result before returning
         logger.info(f"Retrieved {len(result)} subjects successfully")
         
-        return jsonify(result)
+        response = with_next_cursor(jsonify(result), next_cursor)
+        if failed:
+            # Without the ETag and the cache, a retry once decryption works again gets every row
+            return partial_response(response, len(failed))
+        return cache_response(etag, (Subject,), with_etag(response, etag))
     
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting subject info: {str(e)}")
         return jsonify({"error": "Failed to retrieve subject information"}), 500
+
+
+@app.route("/get_subjects_by_grade", methods=["GET"])
+def get_subjects_by_grade():
+    try:
+        authenticate()  # Ensure the request is authenticated
+        
+        grade = request.args.get("grade")
+        if not grade or not grade.strip():
+            return jsonify({"error": "Grade is required."}), 400
+        
+        # Filter on the blind index, so no row has to be decrypted
+        query = Subject.query.with_entities(Subject.subject_id, Subject.subject_name, Subject.user_id) \
+            .filter_by(grade_index=blind_index(grade, current_app.config["BLIND_INDEX_KEY"]))
+        if request.args.get("subject_name"):
+            query = query.filter_by(subject_name=request.args["subject_name"])
+        
+        # Every row matched the requested grade, so it stands in for the decrypted value
+        subjects = query.all()
+        serialize = compile_serializer(("subject_id", "subject_name", "user_id", "grade"), row_layout(subjects))
+        result = serialize(subjects, [grade] * len(subjects))
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        logger.error(f"Error getting subjects by grade: {str(e)}")
+        return jsonify({"error": "Failed to retrieve subject information"}), 500
+
+
+@app.route("/get_grade_stats", methods=["GET"])
+def get_grade_stats():
+    try:
+        authenticate()  # Ensure the request is authenticated
+        
+        # Served from the write-time aggregates, no subject rows are read
+        user_id = request.args.get("user_id", type=int)
+        if user_id:
+            return jsonify(get_user_grade_stats(user_id))
+        
+        return jsonify(get_subject_grade_stats(request.args.get("subject_name")))
+    
+    except Exception as e:
+        logger.error(f"Error getting grade stats: {str(e)}")
+        return jsonify({"error": "Failed to retrieve grade statistics"}), 500
+
+
+@app.route("/get_subjects_by_ids", methods=["POST"])
+def get_subjects_by_ids():
+    try:
+        authenticate()  # Ensure the request is authenticated
+        
+        subject_ids = parse_id_list((request.json or {}).get("subject_ids"), "subject_ids")
+        allowed = (PASSTHROUGH_SUBJECT_FIELDS if is_passthrough_client() else SUBJECT_FIELDS) + ("user_id",)
+        fields = get_fields(allowed) or allowed
+        
+        # One IN query per chunk of IDs, selecting only the requested columns
+        subjects = []
+        for chunk in chunked(subject_ids):
+            statement = select(*subject_columns(fields)).where(Subject.subject_id.in_(chunk))
+            subjects.extend(db.session.execute(statement).all())
+        
+        # Decrypt every grade in a single batch, if grades were asked for. The id is serialized
+        # either way to match rows to the requested ids, and dropped again if it was not asked for.
+        serialized_fields = fields if "subject_id" in fields else ("subject_id",) + fields
+        result, failed = serialize_subjects(subjects, fields=serialized_fields)
+        found = {subject["subject_id"]: subject for subject in result}
+        if "subject_id" not in fields:
+            for subject in result:
+                del subject["subject_id"]
+        failed = set(failed)
+        
+        response = jsonify({
+            "subjects": [found[subject_id] for subject_id in subject_ids if subject_id in found],
+            "missing": [subject_id for subject_id in subject_ids if subject_id not in found and subject_id not in failed],
+            "failed": [subject_id for subject_id in subject_ids if subject_id in failed]
+        })
+        return partial_response(response, len(failed)) if failed else response
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting subjects by IDs: {str(e)}")
+        return jsonify({"error": "Failed to retrieve subject information"}), 500
+
+
+def parse_data_key_ids(value):
+    # ?ids= as comma-separated hex data key ids, duplicates dropped, keeping order; raises ValueError
+    key_ids = list(dict.fromkeys(key_id.strip().lower() for key_id in (value or "").split(",") if key_id.strip()))
+    if not key_ids:
+        raise ValueError("Invalid ids. ids must list at least one data key id.")
+    max_ids = current_app.config.get('MAX_MULTI_GET_IDS', MAX_MULTI_GET_IDS)
+    if len(key_ids) > max_ids:
+        raise ValueError(f"Too many IDs. At most {max_ids} IDs can be requested at once.")
+    for key_id in key_ids:
+        if len(key_id) != 2 * KEY_ID_SIZE or any(char not in "0123456789abcdef" for char in key_id):
+            raise ValueError(f"Invalid data key id: {key_id}. Data key ids are {2 * KEY_ID_SIZE} hex digits.")
+    return key_ids
+
+@app.route("/get_data_keys", methods=["GET"])
+def get_data_keys():
+    try:
+        authenticate()  # Ensure the request is authenticated
+        if not is_passthrough_client():
+            return jsonify({"error": "Data keys are only served to pass-through clients."}), 403
+        
+        key_ids = parse_data_key_ids(request.args.get("ids"))
+        found = {key_id.hex(): wrapped_key for key_id, wrapped_key in get_wrapped_data_keys(map(bytes.fromhex, key_ids)).items()}
+        
+        missing = [key_id for key_id in key_ids if key_id not in found]
+        response = jsonify({
+            "data_keys": {key_id: encode_ciphertext(found[key_id]) for key_id in key_ids if key_id in found},
+            "missing": missing
+        })
+        if not missing:
+            # A data key never changes once stored, so clients can keep what they fetched
+            response.cache_control.private = True
+            response.cache_control.max_age = 86400
+        return response
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting data keys: {str(e)}")
+        return jsonify({"error": "Failed to retrieve data keys"}), 500
+
+
+@app.route("/get_cache_stats", methods=["GET"])
+def get_cache_stats():
+    try:
+        authenticate()  # Ensure the request is authenticated
+        
+        return jsonify({
+            "grade_cache": grade_cache.stats(),
+            "response_cache": response_cache.stats()
+        })
+    
+    except Exception as e:
+        logger.error(f"Error getting cache stats: {str(e)}")
+        return jsonify({"error": "Failed to retrieve cache statistics"}), 500
@@ -1,14 +1,32 @@
-from flask import  Blueprint, request, jsonify, abort, Flask
+from collections import Counter
+
+from flask import  Blueprint, request, jsonify, abort, Flask, current_app
 from app.models import User
 from app.schemas import user_schema, users_schema
+from app.serializers import compile_serializer, row_layout
 from app.utils.auth import authenticate
 from app import db
 from app.models import Subject
 from flask import request, jsonify, abort
 from app import db, logger  # Assuming authenticate function is defined somewhere
-from ..utils.auth import authenticate
-from ..utils.encryption import encrypt_data, decrypt_data
+from ..utils.auth import authenticate, is_passthrough_client
+from ..utils.encryption import encrypt_data, blind_index
+from ..utils.grade_cache import grade_cache
+from ..utils.grade_stats import record_grade
+from ..utils.pagination import paginate, keyset_order, with_next_cursor
+from ..utils.streaming import wants_ndjson, stream_ndjson
+from ..utils.batching import chunked, parse_id_list, BULK_CHUNK_SIZE, MAX_BULK_ITEMS
+from ..utils.upsert import insert_or_get, insert_ignore_statement, collation_key
+from ..utils.etags import make_etag, not_modified, with_etag
+from ..utils.response_cache import cached_response, cache_response, partial_response
+from ..utils.fields import get_fields
+from ..utils.user_stats import get_user_stats, DEFAULT_AGE_BAND, MAX_AGE_BAND
+from ..utils.keys import get_public_key, get_active_key_id
 from app.models import Subject, User  # Adjust based on your models import
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only
+from .subjects import serialize_subjects, subject_columns, SUBJECT_FIELDS, PASSTHROUGH_SUBJECT_FIELDS
 
 
 app = Flask(__name__)
@@ -25,71 +43,275 @@ def add_user_info():
         # Validate user data
         validate_user_data(user_data)
         
-        # Check if the user already exists based on name, age, and gender
-        existing_user = find_existing_user(user_data)
-        if existing_user:
+        # Insert unless the user already exists, in one statement on the (name, age, gender) unique index
+        user_id, created = insert_or_get(
+            User,
+            {"name": user_data["name"], "age": user_data["age"], "gender": user_data["gender"]},
+            USER_KEY_COLUMNS
+        )
+        if not created:
             return jsonify({"message": "User data already exists",
-                            "user_id": existing_user.id})
-        
-        # Create new user and add to database
-        new_user = User(name=user_data["name"], age=user_data["age"], gender=user_data["gender"])
-        db.session.add(new_user)
+                            "user_id": user_id})
         db.session.commit()
 
-        logger.info(f"User added: {new_user}")
+        logger.info(f"User added: {user_id}")
         
-        return jsonify({"user_id": new_user.id})
+        return jsonify({"user_id": user_id})
     
     except Exception as e:
         logger.error(f"Error adding user: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 def validate_user_data(user_data):
+    error = user_data_error(user_data)
+    if error:
+        abort(400, description=error)
+
+def user_data_error(user_data):
     # Validating age
     if not isinstance(user_data.get("age"), int) or user_data.get("age") < 0:
-        abort(400, description="Invalid age. Age must be a non-negative integer.")
+        return "Invalid age. Age must be a non-negative integer."
     
     # Validating name
     if not isinstance(user_data.get("name"), str) or not user_data.get("name").strip():
-        abort(400, description="Invalid name. Name must be a non-empty string.")
+        return "Invalid name. Name must be a non-empty string."
     
     # Validating gender (assuming gender can only be "male" or "female")
     if (not isinstance(user_data.get("gender"), str) or
         not user_data.get("gender").strip() or
             user_data.get("gender") not in ["male", "female"]):
-        abort(400, description="Invalid gender. Gender must be 'male' or 'female'.")
+        return "Invalid gender. Gender must be 'male' or 'female'."
+    return None
+
+# Columns of the User unique index that identify a user
+USER_KEY_COLUMNS = ("name", "age", "gender")
+
+def user_key(name, age, gender):
+    # (name, age, gender) as the unique index compares it, so spellings the database treats as the
+    # same user (different case, on MySQL) are deduplicated and matched back to the stored row
+    return (collation_key(name), age, gender)
+
+def find_existing_users(keys, locking=False):
+    # One set-based lookup for a chunk of (name, age, gender) keys; returns user_key -> user id.
+    # After an insert, locking reads also see rows committed since this transaction's snapshot.
+    statement = select(User.id, User.name, User.age, User.gender).where(
+        tuple_(User.name, User.age, User.gender).in_(keys)
+    )
+    if locking:
+        statement = statement.with_for_update(read=True)
+    existing = {}
+    for row in db.session.execute(statement):
+        existing.setdefault(user_key(row.name, row.age, row.gender), row.id)
+    return existing
+
+def insert_users(keys):
+    # Multi-row insert of new (name, age, gender) keys; returns user_key -> new user id
+    # Rows a concurrent request inserted first are skipped by the unique index rather than failing the chunk
+    if not keys:
+        # An empty executemany would run as a single INSERT ... DEFAULT VALUES
+        return {}
+    rows = [{"name": name, "age": age, "gender": gender} for name, age, gender in keys]
+    statement = insert_ignore_statement(User, USER_KEY_COLUMNS)
+    if db.engine.dialect.insert_executemany_returning:
+        statement = statement.returning(User.id, User.name, User.age, User.gender)
+        return {user_key(row.name, row.age, row.gender): row.id for row in db.session.execute(statement, rows)}
+    # MySQL has no INSERT ... RETURNING: executemany, then read the ids back with one query
+    db.session.execute(statement, rows)
+    return find_existing_users(keys, locking=True)
+
+
+# Fields a user read can return
+USER_FIELDS = ("id", "name", "age", "gender")
+
+def serialize_users(users, fields=USER_FIELDS):
+    # Prepare result as list of dictionaries
+    return compile_serializer(tuple(fields), row_layout(users))(users)
+
+def user_with_subjects_fields(passthrough):
+    # ?fields= of reads returning users with their subjects: user fields, plus "subjects" for all subject
+    # fields or "subjects.<field>" for some of them. Returns (user fields, subject fields), the latter
+    # None when subjects are left out, in which case they are not even queried.
+    subject_fields = PASSTHROUGH_SUBJECT_FIELDS if passthrough else SUBJECT_FIELDS
+    fields = get_fields(USER_FIELDS + ("subjects",) + tuple(f"subjects.{field}" for field in subject_fields))
+    if fields is None:
+        return USER_FIELDS, subject_fields
+    if "subjects" not in fields:
+        subject_fields = tuple(field for field in subject_fields if f"subjects.{field}" in fields) or None
+    return tuple(field for field in fields if field in USER_FIELDS), subject_fields
+
+def user_columns(fields):
+    # Columns that serve fields; the id is always loaded
+    return [User.id] + [getattr(User, field) for field in fields if field != "id"]
+
+
+@app.route("/get_user_stats", methods=["GET"])
+def get_user_stats_info():
+    try:
+        authenticate()  # Ensure the request is authenticated
+        
+        age_band = request.args.get("age_band", DEFAULT_AGE_BAND)
+        try:
+            age_band = int(age_band)
+        except (TypeError, ValueError):
+            age_band = 0
+        if not 0 < age_band <= MAX_AGE_BAND:
+            raise ValueError(f"Invalid age_band. age_band must be an integer from 1 to {MAX_AGE_BAND}.")
+        
+        # Counts by gender, age band and subjects per user, aggregated in SQL
+        return jsonify(get_user_stats(age_band))
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting user stats: {str(e)}")
+        return jsonify({"error": "Failed to retrieve user statistics"}), 500
+
+
+@app.route("/add_users_bulk", methods=["POST"])
+def add_users_bulk():
+    try:
+        authenticate()  # Ensure the request is authenticated
+        
+        users_data = (request.json or {}).get("users")
+        if not isinstance(users_data, list) or not users_data:
+            raise ValueError("Invalid users. users must be a non-empty list of user objects.")
+        max_items = current_app.config.get('MAX_BULK_ITEMS', MAX_BULK_ITEMS)
+        if len(users_data) > max_items:
+            raise ValueError(f"Too many users. At most {max_items} users can be added at once.")
+        
+        # Validate everything up front; invalid items are reported and skipped
+        results = [None] * len(users_data)
+        pending = {}  # user_key -> indexes of the items carrying it
+        values = {}  # user_key -> (name, age, gender) of the first item carrying it, the one inserted
+        for index, user_data in enumerate(users_data):
+            error = user_data_error(user_data) if isinstance(user_data, dict) else "Invalid user. User must be an object."
+            if error:
+                results[index] = {"index": index, "error": error}
+                continue
+            key = user_key(user_data["name"], user_data["age"], user_data["gender"])
+            values.setdefault(key, (user_data["name"], user_data["age"], user_data["gender"]))
+            pending.setdefault(key, []).append(index)
+        
+        # Resolve and insert one chunk of distinct keys at a time, committing per chunk
+        chunk_size = current_app.config.get('BULK_CHUNK_SIZE', BULK_CHUNK_SIZE)
+        for keys in chunked(list(pending), chunk_size):
+            try:
+                existing = find_existing_users([values[key] for key in keys])
+                created = insert_users([values[key] for key in keys if key not in existing])
+                # Keys a concurrent request inserted between the lookup and the insert
+                raced = [values[key] for key in keys if key not in existing and key not in created]
+                if raced:
+                    existing.update(find_existing_users(raced, locking=True))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error adding user chunk: {str(e)}")
+                existing, created = {}, {}
+            
+            for key in keys:
+                for index in pending[key]:
+                    if key in existing:
+                        results[index] = {"index": index, "user_id": existing[key], "status": "exists"}
+                    elif key in created:
+                        results[index] = {"index": index, "user_id": created[key], "status": "created"}
+                    else:
+                        results[index] = {"index": index, "error": "Failed to add user"}
+        
+        logger.info(f"Bulk user ingestion: {len(users_data)} items, {len(pending)} distinct users")
+        
+        return jsonify({"results": results})
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error adding users in bulk: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 
-def find_existing_user(new_user_data):
+# Sort keys for user listings; prefix with '-' for descending. Each is backed by an index on User.
+USER_SORTS = {"id": None, "name": User.name, "age": User.age}
 
-    existing_user = User.query.filter_by(
-        name=new_user_data["name"], 
-        age=new_user_data["age"], 
-        gender=new_user_data["gender"]
-    ).first()
-    return existing_user
+def _non_negative_int_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise ValueError(f"Invalid {name}. {name} must be a non-negative integer.")
+    return int(value)
+
+def user_filters():
+    # Translates ?min_age=, ?max_age=, ?gender= and ?name_prefix= into WHERE criteria; raises ValueError
+    criteria = []
+    min_age = _non_negative_int_arg("min_age")
+    if min_age is not None:
+        criteria.append(User.age >= min_age)
+    max_age = _non_negative_int_arg("max_age")
+    if max_age is not None:
+        criteria.append(User.age <= max_age)
+    gender = request.args.get("gender")
+    if gender is not None:
+        if gender not in ["male", "female"]:
+            raise ValueError("Invalid gender. Gender must be 'male' or 'female'.")
+        criteria.append(User.gender == gender)
+    name_prefix = request.args.get("name_prefix")
+    if name_prefix is not None:
+        if not name_prefix:
+            raise ValueError("Invalid name_prefix. name_prefix must be a non-empty string.")
+        # LIKE 'prefix%' can use the index on name; wildcards in the prefix are escaped
+        criteria.append(User.name.startswith(name_prefix, autoescape=True))
+    return criteria
+
+def user_sort():
+    # Reads ?sort= as (sort spec, sort column or None for id, descending); raises ValueError
+    sort = request.args.get("sort", "id")
+    descending = sort.startswith("-")
+    key = sort[1:] if descending else sort
+    if key not in USER_SORTS:
+        raise ValueError(f"Invalid sort. Sort must be one of {', '.join(USER_SORTS)}, optionally prefixed with '-'.")
+    return sort, USER_SORTS[key], descending
 
 
 @app.route("/get_user_info", methods=["GET"])
 def get_user_info():
     try:
         authenticate()  # Ensure the request is authenticated
+        ndjson = wants_ndjson()
+        fields = get_fields(USER_FIELDS) or USER_FIELDS
+        criteria = user_filters()
+        sort, sort_column, descending = user_sort()
+        # The id and sort column are always selected, pagination needs them
+        columns = user_columns(fields)
+        if sort_column is not None and sort_column.key not in fields:
+            columns.append(sort_column)
+        
+        # Unchanged since the client's copy: answer before reading any rows
+        etag = make_etag("get_user_info", (User,), request.args.to_dict(), ndjson)
+        if response := not_modified(etag):
+            return response
+        
+        # Stream the whole table instead of one page
+        if ndjson:
+            statement = select(*columns).where(*criteria).order_by(*keyset_order(User.id, sort_column, descending))
+            return with_etag(stream_ndjson(statement, lambda users: (serialize_users(users, fields), 0)), etag)
+        
+        # Same ETag, same body: reuse the one already built
+        if response := cached_response(etag):
+            return response
         
-        # Query specific fields from User table
-        users = User.query.with_entities(User.id, User.name, User.age, User.gender).all()
-        
-        # Prepare result as list of dictionaries
-        result = []
-        for user in users:
-            user_dict = {
-                "id": user.id,
-                "name": user.name,
-                "age": user.age,
-                "gender": user.gender
-            }
-            result.append(user_dict)
-        
-        return jsonify(result)
+        # Query one page of the requested fields from User table
+        users, next_cursor = paginate(
+            User.query.with_entities(*columns).filter(*criteria),
+            User.id,
+            f"users:{sort}",
+            sort_column,
+            descending
+        )
+        
+        response = with_etag(with_next_cursor(jsonify(serialize_users(users, fields)), next_cursor), etag)
+        return cache_response(etag, (User,), response)
     
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting user info: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -111,12 +333,7 @@ def get_user_info():
             return jsonify({"error": "User not found."}), 404
         
         # Prepare result as dictionary
-        user_dict = {
-            "id": user.id,
-            "name": user.name,
-            "age": user.age,
-            "gender": user.gender
-        }
+        user_dict = serialize_users([user])[0]
         
         return jsonify(user_dict)
     
@@ -134,47 +351,161 @@ def get_user_and_subjects_by_id():
         if not user_id:
             return jsonify({"error": "User ID is required."}), 400
         
-        # Query specific user by ID from User table
-        user = User.query.filter_by(id=user_id).first()
+        passthrough = is_passthrough_client()
+        user_fields, subject_fields = user_with_subjects_fields(passthrough)
+        models = (User, Subject) if subject_fields else (User,)
+        
+        # Unchanged since the response was last built: reuse it without loading or decrypting anything.
+        # A POST is never answered with 304, so the ETag only keys the cache.
+        etag = make_etag("get_user_by_id", models, user_id, passthrough, user_fields, subject_fields)
+        if response := cached_response(etag):
+            return response
+        
+        # Load the user and their subjects together in one query, only the requested columns of each
+        query = User.query.options(load_only(*user_columns(user_fields)))
+        if subject_fields:
+            query = query.options(joinedload(User.subjects).load_only(*subject_columns(subject_fields)))
+        user = query.filter_by(id=user_id).first()
         
         if not user:
             return jsonify({"error": "User not found."}), 404
         
         # Prepare user data as dictionary
-        user_dict = {
-            "id": user.id,
-            "name": user.name,
-            "age": user.age,
-            "gender": user.gender
-        }
-        
-        # Query subjects for the specific user by user_id
-        subjects = Subject.query.filter_by(user_id=user_id).all()
-        
-        # Prepare subjects data as a list of dictionaries
-        subjects_list = []
-        for subject in subjects:
-            try:
-                decrypted_grade = decrypt_data(subject.encrypted_grade, private_key)
-                subject_dict = {
-                    "subject_id": subject.subject_id,
-                    "subject_name": subject.subject_name,
-                    "grade": decrypted_grade.decode('utf-8')  # Convert bytes to UTF-8 string
-                }
-                subjects_list.append(subject_dict)
-            except Exception as e:
-                logger.error(f"Error decrypting grade for subject ID {subject.subject_id}: {str(e)}")
-                continue
+        user_dict = serialize_users([user], user_fields)[0]
         
         # Add subjects data to user data
-        user_dict["subjects"] = subjects_list
+        failed = []
+        if subject_fields:
+            user_dict["subjects"], failed = serialize_subjects(user.subjects, passthrough, fields=subject_fields)
         
-        return jsonify(user_dict)
+        if failed:
+            # Not cached: a retry once decryption works again gets every subject
+            return partial_response(jsonify(user_dict), len(failed))
+        return cache_response(etag, models, jsonify(user_dict))
     
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting user and subjects by ID: {str(e)}")
         return jsonify({"error": "Failed to retrieve user and subject information"}), 500
 
+@app.route("/get_users_by_ids", methods=["POST"])
+def get_users_and_subjects_by_ids():
+    try:
+        authenticate()  # Ensure the request is authenticated
+        
+        user_ids = parse_id_list((request.json or {}).get("user_ids"), "user_ids")
+        passthrough = is_passthrough_client()
+        user_fields, subject_fields = user_with_subjects_fields(passthrough)
+        
+        # One IN query per table for each chunk of IDs, selecting only the requested columns
+        users = []
+        subjects = []
+        for chunk in chunked(user_ids):
+            users.extend(db.session.execute(select(*user_columns(user_fields)).where(User.id.in_(chunk))).all())
+            if subject_fields:
+                subjects.extend(db.session.execute(
+                    select(*subject_columns(subject_fields), Subject.user_id)
+                    .where(Subject.user_id.in_(chunk))
+                    .order_by(Subject.subject_id)
+                ).all())
+        
+        # Decrypt every grade across all users in a single batch, if grades were asked for
+        subjects_by_user = {}
+        failed = []
+        if subject_fields:
+            result, failed = serialize_subjects(subjects, passthrough, include_user_id=True, fields=subject_fields)
+            for subject_dict in result:
+                subjects_by_user.setdefault(subject_dict.pop("user_id"), []).append(subject_dict)
+        
+        found = {}
+        for user, user_dict in zip(users, serialize_users(users, user_fields)):
+            if subject_fields:
+                user_dict["subjects"] = subjects_by_user.get(user.id, [])
+            found[user.id] = user_dict
+        
+        response = jsonify({
+            "users": [found[user_id] for user_id in user_ids if user_id in found],
+            "missing": [user_id for user_id in user_ids if user_id not in found]
+        })
+        return partial_response(response, len(failed)) if failed else response
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting users by IDs: {str(e)}")
+        return jsonify({"error": "Failed to retrieve user and subject information"}), 500
+
+def update_subjects(subjects_data):
+    # Applies a list of subject updates with one IN query to load them and one bulk UPDATE to write them.
+    # Returns how many subjects actually changed.
+    changes = {}  # subject_id -> merged fields, later entries win
+    for subject_data in subjects_data:
+        subject_id = subject_data.get("subject_id")
+        if not subject_id:
+            abort(400, description="Subject ID is required for updating subject info.")
+        changes.setdefault(subject_id, {}).update(
+            {field: subject_data[field] for field in ("subject_name", "grade") if field in subject_data}
+        )
+
+    subject_ids = list(changes)
+    subjects = {}
+    for chunk in chunked(subject_ids):
+        statement = select(
+            Subject.subject_id, Subject.subject_name, Subject.encrypted_grade, Subject.key_id,
+            Subject.grade_index, Subject.user_id
+        ).where(Subject.subject_id.in_(chunk))
+        subjects.update((row.subject_id, row) for row in db.session.execute(statement))
+    for subject_id in subject_ids:
+        if subject_id not in subjects:
+            abort(404, description=f"Subject with ID {subject_id} not found.")
+
+    rows = []
+    grade_deltas = Counter()  # (subject_name, user_id, grade_index) -> change in count
+    grade_labels = {}
+    key_id = get_active_key_id()
+    public_key = get_public_key(key_id)
+    index_key = current_app.config["BLIND_INDEX_KEY"]
+    for subject_id, fields in changes.items():
+        subject = subjects[subject_id]
+        # Drop values that match what is stored; grades compare through the blind index, no decryption
+        if fields.get("subject_name") == subject.subject_name:
+            del fields["subject_name"]
+        if "grade" in fields and subject.grade_index is not None and \
+                blind_index(fields["grade"], index_key) == subject.grade_index:
+            del fields["grade"]
+        if not fields:
+            continue
+        # Every row carries the same columns, so the whole update is a single executemany
+        row = {
+            "subject_id": subject_id,
+            "subject_name": fields.get("subject_name", subject.subject_name),
+            "encrypted_grade": subject.encrypted_grade,
+            "key_id": subject.key_id,
+            "grade_index": subject.grade_index
+        }
+        if "grade" in fields:
+            # The old grade is simply overwritten, so it never needs decrypting
+            grade = fields["grade"]
+            row["encrypted_grade"] = encrypt_data(grade, public_key)
+            row["key_id"] = key_id
+            row["grade_index"] = blind_index(grade, index_key)
+            grade_labels[row["grade_index"]] = grade
+            grade_cache.invalidate(subject.encrypted_grade)
+            grade_cache.put(row["encrypted_grade"], grade.encode())
+        # Take the subject out of the grade aggregates and count it again once updated
+        grade_deltas[(subject.subject_name, subject.user_id, subject.grade_index)] -= 1
+        grade_deltas[(row["subject_name"], subject.user_id, row["grade_index"])] += 1
+        rows.append(row)
+
+    # Bulk UPDATE by primary key
+    if rows:
+        db.session.execute(update(Subject), rows)
+    for (subject_name, user_id, grade_index), delta in grade_deltas.items():
+        if delta:
+            record_grade(subject_name, user_id, grade_index, grade_labels.get(grade_index), delta=delta)
+    return len(rows)
+
 @app.route("/update_user_info", methods=["PUT"])
 def update_user_info():
     try:
@@ -190,40 +521,32 @@ def update_user_info():
         if not user:
             abort(404, description="User not found.")
 
-        # Update user fields
-        if "name" in user_data:
-            user.name = user_data["name"]
-        if "age" in user_data:
-            user.age = user_data["age"]
-        if "gender" in user_data:
-            user.gender = user_data["gender"]
+        # Update only the user fields that differ from the stored row
+        changed = False
+        for field in ("name", "age", "gender"):
+            if field in user_data and user_data[field] != getattr(user, field):
+                setattr(user, field, user_data[field])
+                changed = True
 
         # Update user's subjects if provided
-        if "subjects" in user_data:
-            for subject_data in user_data["subjects"]:
-                subject_id = subject_data.get("subject_id")
-                if subject_id:
-                    # Find the subject in the database
-                    subject = Subject.query.get(subject_id)
-                    if subject:
-                        if "subject_name" in subject_data:
-                            subject.subject_name = subject_data["subject_name"]
-                        if "grade" in subject_data:
-                            # Example: Decrypt grade if needed
-                            decrypted_grade = decrypt_data(subject.encrypted_grade, private_key)
-                            # Assuming you update encrypted_grade
-                            subject.encrypted_grade = encrypt_data(subject_data["grade"], public_key)
-                    else:
-                        abort(404, description=f"Subject with ID {subject_id} not found.")
-                else:
-                    abort(400, description="Subject ID is required for updating subject info.")
+        if "subjects" in user_data and update_subjects(user_data["subjects"]):
+            changed = True
+
+        # Idempotent resubmissions write nothing
+        if not changed:
+            return jsonify({"message": "User data unchanged", "user_id": user.id, "no_op": True})
 
         db.session.commit()  # Commit changes to the database
 
         logger.info(f"User info updated: {user}")
 
-        return jsonify({"message": "User data updated successfully", "user_id": user.id})
+        return jsonify({"message": "User data updated successfully", "user_id": user.id, "no_op": False})
 
+    except IntegrityError:
+        # The new values collide with a unique index: uq_user_name_age_gender or uq_subject_name_user
+        db.session.rollback()
+        return jsonify({"error": "Update conflicts with an existing user with the same name, age and gender, "
+                                 "or a subject of this user with the same name."}), 409
     except Exception as e:
         logger.error(f"Error updating user info: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -13,7 +13,7 @@ class UserSchema(ma.SQLAlchemyAutoSchema):
 class SubjectSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Subject
-        fields = ('id', 'subject_name', 'encrypted_grade', 'user_id')
+        fields = ('subject_id', 'subject_name', 'encrypted_grade', 'key_id', 'user_id')
 
 user_schema = UserSchema()
 users_schema = UserSchema(many=True)
@@ -0,0 +1,68 @@
+# app/serializers.py
+
+from functools import lru_cache
+from itertools import repeat
+from operator import attrgetter, itemgetter
+
+from app.utils.encryption import encode_ciphertext
+
+# Fields whose output is not the stored column as is: source column and the conversion applied to it.
+# The grade comes from the decoded values passed alongside the rows, not from the row itself.
+_CONVERTED_FIELDS = {
+    "encrypted_grade": ("encrypted_grade", encode_ciphertext),
+}
+
+def row_layout(rows):
+    # Column names of Core rows (read by position), or None for ORM objects (read by attribute)
+    return getattr(rows[0], '_fields', None) if rows else None
+
+def _getter(columns, layout):
+    # One C-level call returning the given columns of a row as a tuple
+    if layout is None:
+        getter = attrgetter(*columns)
+    else:
+        for column in columns:
+            if column not in layout:
+                raise KeyError(f"Rows have no {column!r} column")
+        getter = itemgetter(*(layout.index(column) for column in columns))
+    if len(columns) == 1:
+        # Single-column getters return the value itself rather than a 1-tuple
+        return lambda row: (getter(row),)
+    return getter
+
+@lru_cache(maxsize=256)
+def compile_serializer(fields, layout=None):
+    # Builds, once per field list and row layout, a function turning rows into output dicts: the
+    # plain columns come out of a single itemgetter/attrgetter call per row, converted fields after.
+    # With "grade" in fields the function takes the decoded grades as a second argument and skips
+    # rows whose entry is an exception (decryption or decoding failed).
+    names = tuple(field for field in fields if field != "grade" and field not in _CONVERTED_FIELDS)
+    plain = _getter(names, layout) if names else (lambda row: ())
+    converted = [
+        (field, _getter((_CONVERTED_FIELDS[field][0],), layout), _CONVERTED_FIELDS[field][1])
+        for field in fields if field in _CONVERTED_FIELDS
+    ]
+
+    def build(row):
+        item = dict(zip(names, plain(row)))
+        for field, get, convert in converted:
+            item[field] = convert(get(row)[0])
+        return item
+
+    if "grade" in fields:
+        def serialize(rows, grades):
+            items = []
+            for row, grade in zip(rows, grades):
+                if not isinstance(grade, Exception):
+                    item = build(row)
+                    item["grade"] = grade
+                    items.append(item)
+            return items
+    elif converted:
+        def serialize(rows):
+            return [build(row) for row in rows]
+    else:
+        def serialize(rows):
+            # Iterated entirely in C: no Python frame per row
+            return list(map(dict, map(zip, repeat(names), map(plain, rows))))
+    return serialize
@@ -1,5 +1,7 @@
-from .auth import authenticate
-from .encryption import encrypt_data, decrypt_data
+from .auth import authenticate, is_passthrough_client
+from .encryption import generate_keys, get_cipher_suite, encrypt_data, decrypt_data, decrypt_many, blind_index, encode_ciphertext, decode_ciphertext
+from .grade_cache import grade_cache
+from .keys import load_keys, get_private_key, get_public_key, get_active_key_id
 from .logging_config import configure_logging
 
-__all__ = ['authenticate', 'encrypt_data', 'decrypt_data', 'configure_logging']
+__all__ = ['authenticate', 'is_passthrough_client', 'generate_keys', 'get_cipher_suite', 'encrypt_data', 'decrypt_data', 'decrypt_many', 'blind_index', 'encode_ciphertext', 'decode_ciphertext', 'grade_cache', 'load_keys', 'get_private_key', 'get_public_key', 'get_active_key_id', 'configure_logging']
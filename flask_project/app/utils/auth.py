@@ -1,9 +1,16 @@
-from flask import request, abort
+from flask import request, abort, current_app
 
 API_KEY = 'kabirhere'
 
+def _passthrough_api_keys():
+    return current_app.config.get('PASSTHROUGH_API_KEYS', ())
+
 def authenticate():
     api_key = request.headers.get('ApiKey')
-    if api_key != API_KEY:
+    if api_key != API_KEY and api_key not in _passthrough_api_keys():
         abort(401, description="Unauthorized")
     return "API Key is verified"
+
+def is_passthrough_client():
+    # Trusted clients that hold the keys send and receive grades as ciphertext
+    return request.headers.get('ApiKey') in _passthrough_api_keys()
@@ -0,0 +1,28 @@
+# app/utils/batching.py
+
+from flask import current_app
+
+# Ids per IN (...) clause; keeps statements well under driver and planner limits
+IN_CLAUSE_CHUNK_SIZE = 500
+# Most ids accepted by one multi-get request
+MAX_MULTI_GET_IDS = 10000
+# Rows inserted and committed per transaction by bulk endpoints
+BULK_CHUNK_SIZE = 1000
+# Most items accepted by one bulk request
+MAX_BULK_ITEMS = 10000
+
+def chunked(values, size=None):
+    size = size or current_app.config.get('IN_CLAUSE_CHUNK_SIZE', IN_CLAUSE_CHUNK_SIZE)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def parse_id_list(values, field):
+    # Validates a JSON list of positive integer ids and drops duplicates, keeping order; raises ValueError
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"Invalid {field}. {field} must be a non-empty list of IDs.")
+    max_ids = current_app.config.get('MAX_MULTI_GET_IDS', MAX_MULTI_GET_IDS)
+    if len(values) > max_ids:
+        raise ValueError(f"Too many IDs. At most {max_ids} IDs can be requested at once.")
+    if any(not isinstance(value, int) or isinstance(value, bool) or value <= 0 for value in values):
+        raise ValueError(f"Invalid {field}. IDs must be positive integers.")
+    return list(dict.fromkeys(values))
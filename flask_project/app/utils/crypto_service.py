@@ -0,0 +1,289 @@
+# app/utils/crypto_service.py
+#
+# Optional local decrypt service. A separate process owns the private keys and answers
+# batched decrypt requests over a Unix domain socket; web workers only hold public keys.
+#
+#   python -m app.utils.crypto_service --socket /run/alchemy/crypto.sock
+#
+# Frames are a 4-byte big-endian length followed by the body.
+#   request:  request id (4) | count (4) | count x [key id length (2) | key id | blob length (4) | blob]
+#   response: request id (4) | count (4) | count x [status (1) | length (4) | plaintext or error message]
+# Clients may pipeline any number of requests on one connection; responses carry the request id.
+
+import argparse
+import itertools
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+from flask import Flask
+
+from app import Config, db
+from .encryption import decrypt_many
+from .grade_cache import grade_cache
+from .keys import load_keys, get_private_key
+
+logger = logging.getLogger(__name__)
+
+# Requests arriving within this window are decrypted together, up to MAX_BATCH blobs
+BATCH_WINDOW = 0.002  # seconds
+MAX_BATCH = 1024
+CLIENT_TIMEOUT = 5.0  # seconds
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+class CryptoServiceError(Exception):
+    pass
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Crypto service connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+def _recv_frame(sock):
+    (length,) = struct.unpack('!I', _recv_exactly(sock, 4))
+    return _recv_exactly(sock, length)
+
+def _send_frame(sock, body):
+    sock.sendall(struct.pack('!I', len(body)) + body)
+
+def _encode_request(request_id, items):
+    parts = [struct.pack('!II', request_id, len(items))]
+    for encrypted_data, key_id in items:
+        key_id = (key_id or '').encode()
+        parts.append(struct.pack('!H', len(key_id)) + key_id + struct.pack('!I', len(encrypted_data)) + encrypted_data)
+    return b''.join(parts)
+
+def _decode_request(body):
+    request_id, count = struct.unpack_from('!II', body)
+    offset = 8
+    items = []
+    for _ in range(count):
+        (key_id_length,) = struct.unpack_from('!H', body, offset)
+        offset += 2
+        key_id = body[offset:offset + key_id_length].decode() or None
+        offset += key_id_length
+        (blob_length,) = struct.unpack_from('!I', body, offset)
+        offset += 4
+        items.append((body[offset:offset + blob_length], key_id))
+        offset += blob_length
+    return request_id, items
+
+def _encode_response(request_id, results):
+    parts = [struct.pack('!II', request_id, len(results))]
+    for result in results:
+        if isinstance(result, Exception):
+            message = str(result).encode()
+            parts.append(struct.pack('!BI', STATUS_ERROR, len(message)) + message)
+        else:
+            parts.append(struct.pack('!BI', STATUS_OK, len(result)) + result)
+    return b''.join(parts)
+
+def _decode_response(body):
+    request_id, count = struct.unpack_from('!II', body)
+    offset = 8
+    results = []
+    for _ in range(count):
+        status, length = struct.unpack_from('!BI', body, offset)
+        offset += 5
+        data = body[offset:offset + length]
+        offset += length
+        results.append(data if status == STATUS_OK else CryptoServiceError(data.decode()))
+    return request_id, results
+
+class CryptoService:
+    # Accepts connections, and funnels every request into one queue that a batcher
+    # drains in micro-batches, so concurrent callers share a single parallel decrypt pass.
+
+    def __init__(self, socket_path, app, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.socket_path = socket_path
+        self.app = app  # Gives each batch a database session to read wrapped data keys with
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._requests = queue.Queue()
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen()
+        threading.Thread(target=self._batcher, daemon=True).start()
+        logger.info(f"Crypto service listening on {self.socket_path}")
+
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=self._reader, args=(conn, threading.Lock()), daemon=True).start()
+
+    def _reader(self, conn, write_lock):
+        try:
+            while True:
+                request_id, items = _decode_request(_recv_frame(conn))
+                self._requests.put((conn, write_lock, request_id, items))
+        except (ConnectionError, OSError):
+            pass
+        except Exception as e:
+            logger.error(f"Malformed crypto service request: {str(e)}")
+        finally:
+            conn.close()
+
+    def _next_batch(self):
+        batch = [self._requests.get()]
+        size = len(batch[0][3])
+        deadline = time.monotonic() + self.batch_window
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[3])
+        return batch
+
+    def _decrypt(self, items):
+        # Unknown key ids fail their own row only
+        with self.app.app_context():
+            return decrypt_many([blob for blob, _ in items], get_private_key, key_ids=[key_id for _, key_id in items])
+
+    def _batcher(self):
+        while True:
+            batch = self._next_batch()
+            results = self._decrypt([item for request in batch for item in request[3]])
+
+            offset = 0
+            for conn, write_lock, request_id, items in batch:
+                response = _encode_response(request_id, results[offset:offset + len(items)])
+                offset += len(items)
+                try:
+                    with write_lock:
+                        _send_frame(conn, response)
+                except OSError:
+                    continue  # The client went away; its reader thread cleans up
+
+class CryptoServiceClient:
+    # One pipelined connection per process, shared by all request threads
+
+    def __init__(self, socket_path, timeout=CLIENT_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = {}  # request id -> [event, results]
+        self._ids = itertools.count(1)
+
+    def _connect(self):
+        # Forked workers must not share the parent's socket
+        if self._sock is None or self._pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            self._sock, self._pid = sock, os.getpid()
+            self._pending = {}
+            threading.Thread(target=self._reader, args=(sock,), daemon=True).start()
+        return self._sock
+
+    def _reader(self, sock):
+        try:
+            while True:
+                request_id, results = _decode_response(_recv_frame(sock))
+                with self._lock:
+                    pending = self._pending.get(request_id)
+                if pending:
+                    pending[1] = results
+                    pending[0].set()
+        except Exception as e:
+            with self._lock:
+                # Fail everything still waiting on this connection; the next call reconnects
+                if self._sock is sock:
+                    self._sock = None
+                    for pending in self._pending.values():
+                        pending[1] = e
+                        pending[0].set()
+            sock.close()
+
+    def decrypt_many(self, items):
+        # items are (encrypted_data, key_id) pairs; returns plaintext bytes or an exception per item
+        request_id = next(self._ids) & 0xFFFFFFFF
+        pending = [threading.Event(), None]
+        with self._lock:
+            try:
+                sock = self._connect()
+            except OSError as e:
+                raise CryptoServiceError(f"Crypto service unavailable: {str(e)}")
+            self._pending[request_id] = pending
+            try:
+                _send_frame(sock, _encode_request(request_id, [(bytes(data), key_id) for data, key_id in items]))
+            except OSError as e:
+                # Gone before the reader noticed: wake the reader, which fails every other waiting
+                # call on this connection and lets the next one reconnect
+                del self._pending[request_id]
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                raise CryptoServiceError(f"Crypto service unavailable: {str(e)}")
+
+        try:
+            if not pending[0].wait(self.timeout):
+                raise CryptoServiceError("Timed out waiting for the crypto service")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+        if isinstance(pending[1], Exception):
+            raise CryptoServiceError(f"Crypto service unavailable: {str(pending[1])}")
+        return pending[1]
+
+class RemotePrivateKey:
+    # Stand-in returned by get_private_key() when the private keys live in the crypto service
+
+    def __init__(self, crypto_service, key_id):
+        self.crypto_service = crypto_service
+        self.key_id = key_id
+
+    def decrypt_blob(self, encrypted_data):
+        result = self.crypto_service.decrypt_many([(encrypted_data, self.key_id)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+def database_app(database_uri=None):
+    # Just enough of an app for db.session; the service never serves HTTP
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if database_uri:
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    db.init_app(app)
+    grade_cache.configure(app.config)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve batched grade decryption over a Unix socket.")
+    parser.add_argument('--socket', required=True, help="Path of the Unix socket to listen on.")
+    parser.add_argument('--private-key', default=None, help="Active private key PEM (defaults to private_key.pem).")
+    parser.add_argument('--public-key', default=None, help="Active public key PEM (defaults to public_key.pem).")
+    parser.add_argument('--database-uri', default=None, help="Database holding the wrapped data keys (defaults to Config's).")
+    parser.add_argument('--retired-key', action='append', default=[], help="Private key PEM of a rotated-out pair.")
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW, help="Seconds to wait for more requests per batch.")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help="Maximum blobs decrypted per batch.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_keys(args.private_key, args.public_key, retired_key_paths=args.retired_key)
+    CryptoService(args.socket, database_app(args.database_uri), batch_window=args.batch_window, max_batch=args.max_batch).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,393 @@
 # app/utils/encryption.py
 
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import hashes
+import os
+import base64
+import hashlib
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, x25519
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.backends import default_backend
 
+from sqlalchemy import event, insert
+
+from app import db
+from app.models import DataKey
+from .grade_cache import grade_cache
+
+# Cipher suites. Every ciphertext starts with the id of the suite that wrote it,
+# except rsa-oaep rows, which predate the header and are recognised by having none.
+SUITE_RSA_OAEP = 'rsa-oaep'
+SUITE_RSA_AES_GCM = 'rsa-aes-gcm'
+SUITE_X25519_AES_GCM = 'x25519-aes-gcm'
+
+# Suite used for new writes, set from Config in create_app
+CIPHER_SUITE = SUITE_RSA_AES_GCM
+
+# rsa-aes-gcm (envelope) layout:
+#   version (1 byte) | data key id (8 bytes) | nonce (12 bytes) | AES-GCM ciphertext + tag
+ENVELOPE_VERSION = 2
+KEY_ID_SIZE = 8
+NONCE_SIZE = 12
+HEADER_SIZE = 1 + KEY_ID_SIZE + NONCE_SIZE
+
+# x25519-aes-gcm layout:
+#   version (1 byte) | ephemeral public key (32 bytes) | AES-GCM ciphertext + tag
+X25519_VERSION = 3
+X25519_KEY_SIZE = 32
+
+# Blind index: truncated HMAC-SHA256 of the plaintext, hex encoded
+BLIND_INDEX_LENGTH = 32
+
+_data_keys = {}     # data key id -> AESGCM, unwrapped at most once per process
+_current_keys = {}  # public key fingerprint -> data key id used for new writes
+_wrapped_keys = {}  # data key id -> the data key wrapped by the RSA public key as stored in data_key, or None
+_lock = threading.Lock()
+
+# Data keys minted by a transaction that has not committed yet: public key fingerprint -> data key id
+_PENDING_KEY = 'pending_data_keys'
+
+# Batches smaller than this are decrypted inline; the pool only pays off for larger result sets
+DECRYPT_PARALLEL_THRESHOLD = 64
+DECRYPT_WORKERS = os.cpu_count() or 1
+
+_pool = None
+
 def generate_rsa_keys():
     private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
     public_key = private_key.public_key()
     return private_key, public_key
 
-def encrypt_data(data, public_key):
-    encrypted_data = public_key.encrypt(
-        data.encode(),
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
-        )
+def _oaep():
+    return padding.OAEP(
+        mgf=padding.MGF1(algorithm=hashes.SHA256()),
+        algorithm=hashes.SHA256(),
+        label=None
+    )
+
+def public_key_fingerprint(public_key):
+    der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
     )
+    return hashlib.sha256(der).hexdigest()
+
+def _find_private_key(public_key):
+    from .keys import find_private_key
+    return find_private_key(public_key)
+
+def _current_data_key(public_key):
+    # Every process writes under the first data key stored for the public key, unwrapped once.
+    # Without a local private key to unwrap it (crypto service mode) the process mints its own.
+    fingerprint = public_key_fingerprint(public_key)
+    key_id = _current_keys.get(fingerprint)
+    if key_id is None:
+        key_id = db.session.info.get(_PENDING_KEY, {}).get(fingerprint)
+    if key_id is None:
+        private_key = _find_private_key(public_key)
+        stored = DataKey.query.filter_by(public_key_fingerprint=fingerprint).order_by(DataKey.id).first()
+        if stored is not None and private_key is not None:
+            key_id = bytes.fromhex(stored.id)
+            _load_data_key(key_id, private_key)
+            _current_keys[fingerprint] = key_id
+        else:
+            key_id = _mint_data_key(public_key, fingerprint)
+    return key_id, _data_keys[key_id]
+
+def _mint_data_key(public_key, fingerprint):
+    # The wrapped key is written in the caller's transaction, so it commits with the first row under it.
+    # Until then no other transaction may use it: it becomes current only once that commit succeeds.
+    data_key = AESGCM.generate_key(bit_length=256)
+    wrapped_key = public_key.encrypt(data_key, _oaep())
+    key_id = hashlib.sha256(wrapped_key).digest()[:KEY_ID_SIZE]
+    db.session.execute(insert(DataKey).values(id=key_id.hex(), wrapped_key=wrapped_key, public_key_fingerprint=fingerprint))
+    with _lock:
+        _data_keys[key_id] = AESGCM(data_key)
+        _wrapped_keys[key_id] = wrapped_key
+    db.session.info.setdefault(_PENDING_KEY, {})[fingerprint] = key_id
+    return key_id
+
+def _after_commit(session):
+    for fingerprint, key_id in session.info.pop(_PENDING_KEY, {}).items():
+        _current_keys.setdefault(fingerprint, key_id)
+
+def _after_rollback(session):
+    # Rows written under these keys were rolled back with them
+    session.info.pop(_PENDING_KEY, None)
+
+def track_data_keys(session):
+    # Registers the session hooks that make a newly minted data key current once it is committed
+    event.listen(session, 'after_commit', _after_commit)
+    event.listen(session, 'after_rollback', _after_rollback)
+
+def _stored_wrapped_key(key_id):
+    # None for an unknown key id. Misses are remembered too: a key row commits with the first row
+    # under it, so no ciphertext naming a key id can be read before the key is.
+    if key_id not in _wrapped_keys:
+        stored = db.session.get(DataKey, key_id.hex())
+        _wrapped_keys[key_id] = stored.wrapped_key if stored is not None else None
+    return _wrapped_keys[key_id]
+
+def _load_data_key(key_id, private_key):
+    aesgcm = _data_keys.get(key_id)
+    if aesgcm is not None:
+        return aesgcm
+
+    wrapped_key = _stored_wrapped_key(key_id)
+    if wrapped_key is None:
+        return None
+    with _lock:
+        if key_id not in _data_keys:
+            _data_keys[key_id] = AESGCM(private_key.decrypt(wrapped_key, _oaep()))
+        return _data_keys[key_id]
+
+def clear_data_keys():
+    # Forgets every data key this process has loaded or minted; they are read back from data_key on demand
+    with _lock:
+        _data_keys.clear()
+        _current_keys.clear()
+        _wrapped_keys.clear()
+
+def is_envelope(encrypted_data):
+    return len(encrypted_data) > HEADER_SIZE and encrypted_data[0] == ENVELOPE_VERSION
+
+def get_wrapped_data_keys(key_ids):
+    # Stored wrapped data keys by id, for clients that decrypt envelope rows with the RSA private key
+    # themselves: each ciphertext header names its data key id, and the client unwraps each key once.
+    # Unknown ids are left out.
+    wrapped_keys = {}
+    for key_id in key_ids:
+        wrapped_key = _stored_wrapped_key(key_id)
+        if wrapped_key is not None:
+            wrapped_keys[key_id] = wrapped_key
+    return wrapped_keys
+
+def check_client_ciphertext(encrypted_data, public_key):
+    # Clients encrypting grades themselves have no data key, so they can only write the
+    # self-contained formats: bare rsa-oaep for RSA key pairs, x25519-aes-gcm for X25519 ones
+    if isinstance(public_key, rsa.RSAPublicKey):
+        if len(encrypted_data) != public_key.key_size // 8:
+            raise ValueError(f"Encrypted grade must be an {SUITE_RSA_OAEP} ciphertext of {public_key.key_size // 8} bytes")
+    elif len(encrypted_data) <= 1 + X25519_KEY_SIZE or encrypted_data[0] != X25519_VERSION:
+        raise ValueError(f"Encrypted grade must be an {SUITE_X25519_AES_GCM} ciphertext")
+
+class RsaOaepSuite:
+    # One RSA-2048 OAEP operation per row; the original format
+    name = SUITE_RSA_OAEP
+    private_key_type = rsa.RSAPrivateKey
+    public_key_type = rsa.RSAPublicKey
+
+    def generate_keys(self):
+        return generate_rsa_keys()
+
+    def encrypt(self, data, public_key):
+        return public_key.encrypt(data, _oaep())
+
+    def decrypt(self, encrypted_data, private_key):
+        return private_key.decrypt(encrypted_data, _oaep())
+
+class RsaAesGcmSuite(RsaOaepSuite):
+    # AES-GCM under a data key that is wrapped once by the RSA key
+    name = SUITE_RSA_AES_GCM
+
+    def encrypt(self, data, public_key):
+        key_id, aesgcm = _current_data_key(public_key)
+        nonce = os.urandom(NONCE_SIZE)
+        header = bytes([ENVELOPE_VERSION]) + key_id
+        return header + nonce + aesgcm.encrypt(nonce, data, header)
+
+    def decrypt(self, encrypted_data, private_key):
+        if is_envelope(encrypted_data):
+            header = encrypted_data[:1 + KEY_ID_SIZE]
+            aesgcm = _load_data_key(header[1:], private_key)
+            # An unknown key id means this is a legacy RSA blob that happens to start with the version byte
+            if aesgcm is not None:
+                nonce = encrypted_data[1 + KEY_ID_SIZE:HEADER_SIZE]
+                return aesgcm.decrypt(nonce, encrypted_data[HEADER_SIZE:], header)
+        return super().decrypt(encrypted_data, private_key)
+
+class X25519AesGcmSuite:
+    # ECIES-style hybrid: an ephemeral X25519 exchange per row derives a one-time AES-GCM key.
+    # Decryption costs one X25519 operation, a small fraction of an RSA-2048 private-key operation.
+    name = SUITE_X25519_AES_GCM
+    private_key_type = x25519.X25519PrivateKey
+    public_key_type = x25519.X25519PublicKey
+
+    # Every row gets a fresh key, so a constant nonce never repeats under the same key
+    _nonce = bytes(NONCE_SIZE)
+
+    def generate_keys(self):
+        private_key = x25519.X25519PrivateKey.generate()
+        return private_key, private_key.public_key()
+
+    @staticmethod
+    def _raw(public_key):
+        return public_key.public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
+
+    def _derive(self, shared_key, ephemeral_public, recipient_public):
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'grade' + ephemeral_public + recipient_public,
+            backend=default_backend()
+        ).derive(shared_key)
+
+    def encrypt(self, data, public_key):
+        ephemeral_key = x25519.X25519PrivateKey.generate()
+        ephemeral_public = self._raw(ephemeral_key.public_key())
+        header = bytes([X25519_VERSION]) + ephemeral_public
+        key = self._derive(ephemeral_key.exchange(public_key), ephemeral_public, self._raw(public_key))
+        return header + AESGCM(key).encrypt(self._nonce, data, header)
+
+    def decrypt(self, encrypted_data, private_key):
+        if len(encrypted_data) <= 1 + X25519_KEY_SIZE or encrypted_data[0] != X25519_VERSION:
+            raise ValueError("Not an x25519-aes-gcm ciphertext")
+        header = encrypted_data[:1 + X25519_KEY_SIZE]
+        ephemeral_public = header[1:]
+        shared_key = private_key.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public))
+        key = self._derive(shared_key, ephemeral_public, self._raw(private_key.public_key()))
+        return AESGCM(key).decrypt(self._nonce, encrypted_data[1 + X25519_KEY_SIZE:], header)
+
+CIPHER_SUITES = {suite.name: suite for suite in (RsaOaepSuite(), RsaAesGcmSuite(), X25519AesGcmSuite())}
+
+def get_cipher_suite(name=None):
+    try:
+        return CIPHER_SUITES[name or CIPHER_SUITE]
+    except KeyError:
+        raise ValueError(f"Unknown cipher suite: {name or CIPHER_SUITE}")
+
+def generate_keys(suite=None):
+    return get_cipher_suite(suite).generate_keys()
+
+def encrypt_data(data, public_key, suite=None):
+    suite = get_cipher_suite(suite)
+    if not isinstance(public_key, suite.public_key_type):
+        raise ValueError(f"Cipher suite {suite.name} cannot encrypt with a {type(public_key).__name__}")
+    encrypted_data = suite.encrypt(data.encode(), public_key)
     return encrypted_data
 
+def _decrypt(encrypted_data, private_key):
+    # The key type picks the family; rsa-aes-gcm falls back to bare RSA-OAEP for headerless rows
+    if isinstance(private_key, x25519.X25519PrivateKey):
+        return CIPHER_SUITES[SUITE_X25519_AES_GCM].decrypt(encrypted_data, private_key)
+    return CIPHER_SUITES[SUITE_RSA_AES_GCM].decrypt(encrypted_data, private_key)
+
+def _is_remote(private_key):
+    # RemotePrivateKey handles from the crypto service carry a client instead of key material
+    return hasattr(private_key, 'crypto_service')
+
 def decrypt_data(encrypted_data, private_key):
     try:
-        decrypted_data = private_key.decrypt(
-            encrypted_data,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
+        encrypted_data = bytes(encrypted_data)
+        decrypted_data = grade_cache.get(encrypted_data)
+        if decrypted_data is None:
+            if _is_remote(private_key):
+                decrypted_data = private_key.decrypt_blob(encrypted_data)
+            else:
+                decrypted_data = _decrypt(encrypted_data, private_key)
+            grade_cache.put(encrypted_data, decrypted_data)
         return decrypted_data
     except Exception as e:
         # Handle decryption errors appropriately
         raise
+
+def encode_ciphertext(encrypted_data):
+    return base64.b64encode(bytes(encrypted_data)).decode('ascii')
+
+def decode_ciphertext(encoded_data):
+    return base64.b64decode(encoded_data, validate=True)
+
+def blind_index(data, index_key):
+    # Deterministic, keyed digest of a grade so equality filters can run in SQL without decrypting
+    if isinstance(index_key, str):
+        index_key = index_key.encode()
+    return hmac.new(index_key, data.encode(), hashlib.sha256).hexdigest()[:BLIND_INDEX_LENGTH]
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=DECRYPT_WORKERS, thread_name_prefix='decrypt')
+    return _pool
+
+def _decrypt_chunk(chunk):
+    # A failing row yields its exception instead of failing the whole batch
+    results = []
+    for encrypted_data, private_key in chunk:
+        if isinstance(private_key, Exception):
+            # The row's key could not be resolved
+            results.append(private_key)
+            continue
+        try:
+            results.append(decrypt_data(encrypted_data, private_key))
+        except Exception as e:
+            results.append(e)
+    return results
+
+def _decrypt_remote(rows):
+    # Everything the cache can't answer goes to the crypto service in a single request
+    results = [
+        private_key if isinstance(private_key, Exception) else grade_cache.get(bytes(encrypted_data))
+        for encrypted_data, private_key in rows
+    ]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        crypto_service = rows[misses[0]][1].crypto_service
+        try:
+            decrypted = crypto_service.decrypt_many([(bytes(rows[i][0]), rows[i][1].key_id) for i in misses])
+        except Exception as e:
+            decrypted = [e] * len(misses)
+        for i, result in zip(misses, decrypted):
+            results[i] = result
+            if not isinstance(result, Exception):
+                grade_cache.put(bytes(rows[i][0]), result)
+    return results
+
+def _resolve_keys(resolve_key, key_ids):
+    # One lookup per distinct key id; a lookup that fails becomes the exception for its rows
+    resolved = {}
+    for key_id in key_ids:
+        if key_id not in resolved:
+            try:
+                resolved[key_id] = resolve_key(key_id)
+            except Exception as e:
+                resolved[key_id] = e
+    return [resolved[key_id] for key_id in key_ids]
+
+def decrypt_many(encrypted_blobs, private_key, key_ids=None):
+    # Returns one entry per blob, in order: the plaintext bytes, or the exception raised for that row.
+    # private_key is either one key for every blob or a list with one key per blob. With key_ids it is
+    # a function from key id to private key (get_private_key), applied per row, so an unknown key id
+    # only fails the rows stored under it.
+    encrypted_blobs = list(encrypted_blobs)
+    if key_ids is not None:
+        private_keys = _resolve_keys(private_key, list(key_ids))
+    elif isinstance(private_key, (list, tuple)):
+        private_keys = private_key
+    else:
+        private_keys = [private_key] * len(encrypted_blobs)
+    rows = list(zip(encrypted_blobs, private_keys))
+    if any(_is_remote(key) for _, key in rows):
+        return _decrypt_remote(rows)
+    if len(rows) < DECRYPT_PARALLEL_THRESHOLD or DECRYPT_WORKERS < 2:
+        return _decrypt_chunk(rows)
+
+    # Pool threads have no app context to read data_key with, so the data keys are loaded here first
+    for encrypted_data, key in rows:
+        if isinstance(key, rsa.RSAPrivateKey) and is_envelope(encrypted_data):
+            try:
+                _load_data_key(bytes(encrypted_data[1:1 + KEY_ID_SIZE]), key)
+            except Exception:
+                pass  # Reported by the row's own decryption
+    chunk_size = -(-len(rows) // DECRYPT_WORKERS)
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    results = []
+    for chunk_results in _get_pool().map(_decrypt_chunk, chunks):
+        results.extend(chunk_results)
+    return results
@@ -0,0 +1,94 @@
+# app/utils/etags.py
+
+import hashlib
+import json
+import random
+
+from flask import Response, current_app, request
+from sqlalchemy import event, func, select, update
+
+from app import db
+from app.models import TableVersion
+from .upsert import increment_statement, insert_ignore_statement
+
+# Counter rows per table; more shards mean fewer writers queueing on one row lock
+TABLE_VERSION_SHARDS = 16
+
+_TOUCHED_KEY = 'touched_tables'
+# Tables written by the transaction being committed, for after_commit listeners
+COMMITTED_TABLES_KEY = 'committed_tables'
+
+def _touch(session, table_name):
+    if table_name != TableVersion.__tablename__:
+        session.info.setdefault(_TOUCHED_KEY, set()).add(table_name)
+
+def _before_flush(session, flush_context, instances):
+    # Unit-of-work writes: session.add(), attribute changes, session.delete()
+    modified = (obj for obj in session.dirty if session.is_modified(obj))
+    for obj in (*session.new, *session.deleted, *modified):
+        _touch(session, obj.__table__.name)
+
+def _do_orm_execute(orm_execute_state):
+    # Statement writes: bulk UPDATE/INSERT/DELETE and upserts run through session.execute()
+    statement = orm_execute_state.statement
+    if statement.is_dml:
+        _touch(orm_execute_state.session, statement.table.name)
+
+def _before_commit(session):
+    # Bump the counters of every table written in this transaction, atomically with the writes.
+    # Each goes to a random shard, so concurrent writers to a table seldom serialize on one row.
+    session.flush()
+    tables = session.info.pop(_TOUCHED_KEY, set())
+    session.info[COMMITTED_TABLES_KEY] = tables
+    shards = current_app.config.get('TABLE_VERSION_SHARDS', TABLE_VERSION_SHARDS)
+    for table_name in sorted(tables):
+        keys = {"table_name": table_name, "shard": random.randrange(shards)}
+        upsert = increment_statement(TableVersion, keys, "version", 1)
+        if upsert is not None:
+            session.execute(upsert.values(version=1, **keys))
+            continue
+        bump = update(TableVersion).filter_by(**keys).values(version=TableVersion.version + 1)
+        if not session.execute(bump).rowcount:
+            # First write to this shard: seed the row (a concurrent seeder may win), then bump it
+            session.execute(insert_ignore_statement(TableVersion, keys).values(version=0, **keys))
+            session.execute(bump)
+
+def _after_rollback(session):
+    session.info.pop(_TOUCHED_KEY, None)
+    session.info.pop(COMMITTED_TABLES_KEY, None)
+
+def track_table_versions(session):
+    # Registers the session hooks that keep TableVersion in step with every committed write
+    event.listen(session, 'before_flush', _before_flush)
+    event.listen(session, 'do_orm_execute', _do_orm_execute)
+    event.listen(session, 'before_commit', _before_commit)
+    event.listen(session, 'after_rollback', _after_rollback)
+
+def table_versions(*models):
+    names = [model.__table__.name for model in models]
+    rows = db.session.execute(
+        select(TableVersion.table_name, func.sum(TableVersion.version))
+        .where(TableVersion.table_name.in_(names))
+        .group_by(TableVersion.table_name)
+    )
+    versions = dict.fromkeys(names, 0)
+    versions.update((table_name, int(version)) for table_name, version in rows)
+    return versions
+
+def make_etag(scope, models, *params):
+    # Strong ETag over the versions of the tables a response reads plus everything else it depends on
+    payload = json.dumps([scope, table_versions(*models), params], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+def not_modified(etag):
+    # 304 response when the client already holds this version, else None. Only GET and HEAD are
+    # conditional: other methods always get their full response.
+    if request.method in ('GET', 'HEAD') and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,16 @@
+# app/utils/fields.py
+
+from flask import request
+
+def get_fields(allowed):
+    # Reads ?fields=a,b from the request, in the order of allowed; None when absent. Raises ValueError for bad input
+    value = request.args.get("fields")
+    if value is None:
+        return None
+    fields = {field.strip() for field in value.split(",") if field.strip()}
+    if not fields:
+        raise ValueError("Invalid fields. fields must name at least one field.")
+    unknown = sorted(fields.difference(allowed))
+    if unknown:
+        raise ValueError(f"Invalid fields: {', '.join(unknown)}. Allowed fields are {', '.join(allowed)}.")
+    return tuple(field for field in allowed if field in fields)
@@ -0,0 +1,99 @@
+# app/utils/grade_cache.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Default bounds for the process-wide cache of decrypted grades
+GRADE_CACHE_MAX_ENTRIES = 50000
+GRADE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+GRADE_CACHE_TTL = 300  # seconds
+
+DIGEST_SIZE = 16
+
+class GradeCache:
+    # LRU + TTL cache of plaintext grades keyed by a digest of the ciphertext.
+    # Entries are content-addressed, so a rewritten row can never be served a stale grade;
+    # invalidate() just releases the memory held by the old ciphertext.
+
+    def __init__(self, max_entries=GRADE_CACHE_MAX_ENTRIES, max_bytes=GRADE_CACHE_MAX_BYTES, ttl=GRADE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # digest -> (plaintext, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, config):
+        self.max_entries = config.get('GRADE_CACHE_MAX_ENTRIES', GRADE_CACHE_MAX_ENTRIES)
+        self.max_bytes = config.get('GRADE_CACHE_MAX_BYTES', GRADE_CACHE_MAX_BYTES)
+        self.ttl = config.get('GRADE_CACHE_TTL', GRADE_CACHE_TTL)
+        self.clear()
+
+    @staticmethod
+    def _key(encrypted_data):
+        return hashlib.blake2b(bytes(encrypted_data), digest_size=DIGEST_SIZE).digest()
+
+    def _remove(self, key):
+        plaintext, _ = self._entries.pop(key)
+        self._bytes -= len(plaintext) + DIGEST_SIZE
+
+    def get(self, encrypted_data):
+        key = self._key(encrypted_data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            plaintext, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return plaintext
+
+    def put(self, encrypted_data, plaintext):
+        size = len(plaintext) + DIGEST_SIZE
+        if size > self.max_bytes:
+            return
+        key = self._key(encrypted_data)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (plaintext, time.monotonic() + self.ttl)
+            self._bytes += size
+            # Evict least recently used entries until both bounds hold again
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, encrypted_data):
+        key = self._key(encrypted_data)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+grade_cache = GradeCache()
@@ -0,0 +1,130 @@
+# app/utils/grade_stats.py
+
+import logging
+from collections import Counter
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import update
+
+from app import db
+from app.models import Subject, SubjectGradeStat, UserGradeStat
+from .encryption import decrypt_many, blind_index
+from .keys import get_private_key
+from .upsert import increment_statement
+
+logger = logging.getLogger(__name__)
+
+REBUILD_BATCH_SIZE = 500
+
+def _bump(model, keys, grade, delta):
+    # Adjust the counter in SQL so concurrent writers don't lose increments
+    if delta > 0 and grade is not None:
+        # Creates the counter on first use; the upsert keeps concurrent first writers from colliding
+        upsert = increment_statement(model, keys, "count", delta)
+        if upsert is not None:
+            db.session.execute(upsert.values(grade=grade, count=delta, **keys))
+            return
+    updated = db.session.execute(
+        update(model)
+        .filter_by(**keys)
+        .values(count=model.count + delta)
+        .execution_options(synchronize_session=False)
+    )
+    if not updated.rowcount and delta > 0:
+        if grade is None:
+            # No label for this grade anywhere (stats never rebuilt): leave it to rebuild-grade-stats
+            logger.warning(f"Grade stats have no label for grade index {keys['grade_index']}; run rebuild-grade-stats")
+            return
+        db.session.add(model(grade=grade, count=delta, **keys))
+
+def _grade_label(grade_index):
+    stat = UserGradeStat.query.filter_by(grade_index=grade_index).first()
+    return stat.grade if stat else None
+
+def record_grade(subject_name, user_id, grade_index, grade=None, delta=1):
+    # Counts one subject in (or, with delta=-1, out of) the per-subject and per-user aggregates.
+    # Runs in the caller's session, so the counters commit atomically with the subject row.
+    if grade_index is None:
+        return
+    grade = grade or _grade_label(grade_index)
+    _bump(SubjectGradeStat, {"subject_name": subject_name, "grade_index": grade_index}, grade, delta)
+    _bump(UserGradeStat, {"user_id": user_id, "grade_index": grade_index}, grade, delta)
+
+def get_subject_grade_stats(subject_name=None):
+    query = SubjectGradeStat.query.filter(SubjectGradeStat.count > 0)
+    if subject_name:
+        query = query.filter_by(subject_name=subject_name)
+
+    result = {}
+    for stat in query.all():
+        result.setdefault(stat.subject_name, {})[stat.grade] = stat.count
+    return result
+
+def get_user_grade_stats(user_id):
+    stats = UserGradeStat.query.filter(UserGradeStat.user_id == user_id, UserGradeStat.count > 0).all()
+    grades = {stat.grade: stat.count for stat in stats}
+    return {"user_id": user_id, "subject_count": sum(grades.values()), "grades": grades}
+
+def rebuild_grade_stats(batch_size=REBUILD_BATCH_SIZE):
+    # Recomputes both aggregate tables from scratch; needed once for rows written before them.
+    # Rows without a blind index get one, as backfill-grade-index would give them.
+    index_key = current_app.config["BLIND_INDEX_KEY"]
+    subject_counts = Counter()
+    user_counts = Counter()
+    labels = {}
+
+    last_id = 0
+    while True:
+        subjects = Subject.query.filter(Subject.subject_id > last_id) \
+            .order_by(Subject.subject_id) \
+            .limit(batch_size) \
+            .all()
+        if not subjects:
+            break
+
+        decrypted_grades = decrypt_many(
+            [subject.encrypted_grade for subject in subjects],
+            get_private_key,
+            key_ids=[subject.key_id for subject in subjects]
+        )
+        for subject, decrypted_grade in zip(subjects, decrypted_grades):
+            if isinstance(decrypted_grade, Exception):
+                logger.error(f"Error decrypting grade for subject ID {subject.subject_id}: {str(decrypted_grade)}")
+                continue
+            grade = decrypted_grade.decode('utf-8')
+            grade_index = blind_index(grade, index_key)
+            if subject.grade_index is None:
+                # Store the index it is counted under, or a later update would only count it again
+                db.session.execute(
+                    update(Subject)
+                    .where(Subject.subject_id == subject.subject_id, Subject.grade_index.is_(None))
+                    .values(grade_index=grade_index)
+                    .execution_options(synchronize_session=False)
+                )
+            labels[grade_index] = grade
+            subject_counts[(subject.subject_name, grade_index)] += 1
+            user_counts[(subject.user_id, grade_index)] += 1
+        last_id = subjects[-1].subject_id
+
+    SubjectGradeStat.query.delete()
+    UserGradeStat.query.delete()
+    db.session.add_all([
+        SubjectGradeStat(subject_name, grade_index, labels[grade_index], count)
+        for (subject_name, grade_index), count in subject_counts.items()
+    ])
+    db.session.add_all([
+        UserGradeStat(user_id, grade_index, labels[grade_index], count)
+        for (user_id, grade_index), count in user_counts.items()
+    ])
+    db.session.commit()
+    return {"subject_stats": len(subject_counts), "user_stats": len(user_counts)}
+
+@click.command('rebuild-grade-stats')
+@click.option('--batch-size', default=REBUILD_BATCH_SIZE, show_default=True, help='Subjects decrypted per batch.')
+@with_appcontext
+def rebuild_grade_stats_command(batch_size):
+    """Recompute the per-subject and per-user grade aggregates."""
+    result = rebuild_grade_stats(batch_size=batch_size)
+    click.echo(f"Rebuilt {result['subject_stats']} subject and {result['user_stats']} user grade counts")
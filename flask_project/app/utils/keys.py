@@ -0,0 +1,97 @@
+# app/utils/keys.py
+
+import os
+import threading
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.backends import default_backend
+
+from .encryption import public_key_fingerprint
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Written by generate_keys.py
+PRIVATE_KEY_PATH = os.path.join(BASE_DIR, 'private_key.pem')
+PUBLIC_KEY_PATH = os.path.join(BASE_DIR, 'public_key.pem')
+
+KEY_ID_LENGTH = 16
+
+# Parsed keys are kept for the life of the process. Loading them in the parent
+# (create_app) before a pre-forking server forks lets every worker inherit them.
+_key_pairs = {}  # key id -> (private_key, public_key)
+_active_key_id = None
+_crypto_service = None  # CryptoServiceClient when the private keys live in the crypto service
+_lock = threading.Lock()
+
+def key_id_for(public_key):
+    return public_key_fingerprint(public_key)[:KEY_ID_LENGTH]
+
+def _read_private_key(path, password=None):
+    with open(path, 'rb') as f:
+        return serialization.load_pem_private_key(f.read(), password=password, backend=default_backend())
+
+def register_key_pair(private_key, public_key=None):
+    public_key = public_key or private_key.public_key()
+    if public_key_fingerprint(public_key) != public_key_fingerprint(private_key.public_key()):
+        raise ValueError("Public key does not match the private key")
+    key_id = key_id_for(public_key)
+    _key_pairs[key_id] = (private_key, public_key)
+    return key_id
+
+def load_keys(private_key_path=None, public_key_path=None, password=None, retired_key_paths=(), crypto_service=None):
+    # The pair at private_key_path encrypts new rows; retired keys are only kept to decrypt old ones.
+    # With a crypto service only the public key is loaded and decryption is delegated to it.
+    global _active_key_id, _crypto_service
+    with _lock:
+        if _active_key_id is None and crypto_service is not None:
+            with open(public_key_path or PUBLIC_KEY_PATH, 'rb') as f:
+                public_key = serialization.load_pem_public_key(f.read(), backend=default_backend())
+            _active_key_id = key_id_for(public_key)
+            _key_pairs[_active_key_id] = (None, public_key)
+            _crypto_service = crypto_service
+
+        if _active_key_id is None:
+            private_key = _read_private_key(private_key_path or PRIVATE_KEY_PATH, password)
+
+            # Fall back to deriving the public key if only the private key was deployed
+            public_key_path = public_key_path or PUBLIC_KEY_PATH
+            if os.path.exists(public_key_path):
+                with open(public_key_path, 'rb') as f:
+                    public_key = serialization.load_pem_public_key(f.read(), backend=default_backend())
+            else:
+                public_key = private_key.public_key()
+
+            for path in retired_key_paths:
+                register_key_pair(_read_private_key(path, password))
+            _active_key_id = register_key_pair(private_key, public_key)
+        return _key_pairs[_active_key_id]
+
+def get_active_key_id():
+    if _active_key_id is None:
+        load_keys()
+    return _active_key_id
+
+def get_key_ids():
+    get_active_key_id()
+    return list(_key_pairs)
+
+def _get_key_pair(key_id=None):
+    key_id = key_id or get_active_key_id()
+    try:
+        return _key_pairs[key_id]
+    except KeyError:
+        raise ValueError(f"Unknown key id: {key_id}")
+
+def find_private_key(public_key):
+    # The local private key of a registered public key; None when it is unknown or held by the crypto service
+    key_pair = _key_pairs.get(key_id_for(public_key))
+    return key_pair[0] if key_pair else None
+
+def get_private_key(key_id=None):
+    if _crypto_service is not None:
+        from .crypto_service import RemotePrivateKey
+        return RemotePrivateKey(_crypto_service, key_id or get_active_key_id())
+    return _get_key_pair(key_id)[0]
+
+def get_public_key(key_id=None):
+    return _get_key_pair(key_id)[1]
@@ -0,0 +1,78 @@
+# app/utils/pagination.py
+
+from flask import request, current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Response header carrying the cursor for the next page; absent on the last page
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+def _serializer(scope):
+    # Cursors are signed with the app secret, so clients can't forge or reuse them across endpoints
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt=f'cursor:{scope}')
+
+def encode_cursor(last_id, scope, sort_value=None):
+    payload = {"after": last_id}
+    if sort_value is not None:
+        payload["key"] = sort_value
+    return _serializer(scope).dumps(payload)
+
+def decode_cursor(cursor, scope):
+    # Returns (last id, last sort value or None)
+    try:
+        payload = _serializer(scope).loads(cursor)
+        after = payload["after"]
+    except (BadSignature, KeyError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(after, int):
+        raise ValueError("Invalid cursor.")
+    return after, payload.get("key")
+
+def get_page_args(scope):
+    # Reads ?limit= and ?after= from the request as (limit, last id, last sort value); raises ValueError for bad input
+    max_page_size = current_app.config.get('MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    limit = request.args.get("limit", current_app.config.get('DEFAULT_PAGE_SIZE', DEFAULT_PAGE_SIZE))
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid limit. Limit must be a positive integer.")
+    if limit <= 0:
+        raise ValueError("Invalid limit. Limit must be a positive integer.")
+
+    after = request.args.get("after")
+    after, sort_value = decode_cursor(after, scope) if after else (None, None)
+    return min(limit, max_page_size), after, sort_value
+
+def keyset_order(id_column, sort_column=None, descending=False):
+    # ORDER BY for a listing sorted on sort_column, with the primary key breaking ties
+    columns = [id_column] if sort_column is None else [sort_column, id_column]
+    return [column.desc() for column in columns] if descending else columns
+
+def paginate(query, id_column, scope, sort_column=None, descending=False):
+    # Keyset pagination: WHERE (sort, id) > (:key, :after) ORDER BY sort, id LIMIT :limit + 1.
+    # Without a sort column the primary key alone is the key. The scope must differ per sort order.
+    limit, after, sort_value = get_page_args(scope)
+    if after is not None:
+        if sort_column is None:
+            position, bound = id_column, after
+        elif sort_value is None:
+            raise ValueError("Invalid cursor.")
+        else:
+            position, bound = tuple_(sort_column, id_column), tuple_(sort_value, after)
+        query = query.filter(position < bound if descending else position > bound)
+    rows = query.order_by(*keyset_order(id_column, sort_column, descending)).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        sort_value = getattr(rows[-1], sort_column.key) if sort_column is not None else None
+        next_cursor = encode_cursor(getattr(rows[-1], id_column.key), scope, sort_value)
+    return rows, next_cursor
+
+def with_next_cursor(response, next_cursor):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
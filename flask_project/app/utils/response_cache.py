@@ -0,0 +1,244 @@
+# app/utils/response_cache.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response
+from sqlalchemy import event
+
+from .etags import COMMITTED_TABLES_KEY
+
+# Default bounds for the in-process (L1) response cache
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+RESPONSE_CACHE_TTL = 60  # seconds
+# Shared (L2) entries live longer: they are only useful if they outlast a single process's L1
+RESPONSE_CACHE_L2_TTL = 300  # seconds
+
+# Response headers worth replaying from a cached entry
+CACHED_HEADERS = ('ETag', 'X-Next-Cursor')
+
+class SqliteResponseStore:
+    # Shared L2 backend in a local SQLite file, usable by every worker process on the host.
+    # Stand-in for a networked store: anything with get/put/invalidate_tags/clear can replace it.
+
+    def __init__(self, path, ttl=RESPONSE_CACHE_L2_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()  # sqlite3 connections can't be shared between threads
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS entry (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS entry_tag (tag TEXT, key TEXT, PRIMARY KEY (tag, key))")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM entry WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, value, tags):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute("INSERT OR REPLACE INTO entry VALUES (?, ?, ?)", (key, value, time.time() + self.ttl))
+            connection.executemany("INSERT OR IGNORE INTO entry_tag VALUES (?, ?)", [(tag, key) for tag in tags])
+
+    def invalidate_tags(self, tags):
+        connection = self._connection()
+        marks = ','.join('?' * len(tags))
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute(f"DELETE FROM entry WHERE key IN (SELECT key FROM entry_tag WHERE tag IN ({marks}))", tags)
+            connection.execute(f"DELETE FROM entry_tag WHERE key IN (SELECT key FROM entry_tag WHERE tag IN ({marks}))", tags)
+            # Sweep expired entries while holding the write lock anyway
+            now = time.time()
+            connection.execute("DELETE FROM entry_tag WHERE key IN (SELECT key FROM entry WHERE expires_at <= ?)", (now,))
+            connection.execute("DELETE FROM entry WHERE expires_at <= ?", (now,))
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute("DELETE FROM entry")
+            connection.execute("DELETE FROM entry_tag")
+
+class ResponseCache:
+    # Two-level cache of serialized read responses. Keys are the responses' ETags, which already
+    # cover the table versions, request parameters and client mode, so a hit is always current;
+    # entries are also tagged with the tables they read and dropped as soon as a write to one commits.
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 ttl=RESPONSE_CACHE_TTL, l2=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.l2 = l2
+        self.enabled = True
+        self._entries = OrderedDict()  # key -> (value, tags, expires_at)
+        self._tags = {}  # table name -> keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def configure(self, config):
+        self.enabled = config.get('RESPONSE_CACHE_ENABLED', True)
+        self.max_entries = config.get('RESPONSE_CACHE_MAX_ENTRIES', RESPONSE_CACHE_MAX_ENTRIES)
+        self.max_bytes = config.get('RESPONSE_CACHE_MAX_BYTES', RESPONSE_CACHE_MAX_BYTES)
+        self.ttl = config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL)
+        l2_path = config.get('RESPONSE_CACHE_L2_PATH')
+        self.l2 = SqliteResponseStore(l2_path, config.get('RESPONSE_CACHE_L2_TTL', RESPONSE_CACHE_L2_TTL)) if l2_path else None
+        # Only the local level: the shared one belongs to every worker, and its entries are still current
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        value, tags, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _put_local(self, key, value, tags):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, tags, time.monotonic() + self.ttl)
+            self._bytes += len(value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            # Evict least recently used entries until both bounds hold again
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        value = self.l2.get(key) if self.l2 else None
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        # Promote shared hits so the next lookup stays in-process
+        value, tags = _split_tags(value)
+        self._put_local(key, value, tags)
+        with self._lock:
+            self.l2_hits += 1
+        return value
+
+    def put(self, key, value, tags):
+        if not self.enabled:
+            return
+        tags = tuple(tags)
+        self._put_local(key, value, tags)
+        if self.l2:
+            self.l2.put(key, _join_tags(value, tags), tags)
+
+    def invalidate_tags(self, tags):
+        tags = list(tags)
+        if not tags:
+            return
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+        if self.l2:
+            self.l2.invalidate_tags(tags)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+        if self.l2:
+            self.l2.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.l2_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "l2_hits": self.l2_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.hits + self.l2_hits) / lookups if lookups else 0.0
+            }
+
+def _join_tags(value, tags):
+    # L2 values carry their tags so a promoted entry is invalidated like a local one
+    return json.dumps(tags).encode() + b'\n' + value
+
+def _split_tags(value):
+    tags, value = bytes(value).split(b'\n', 1)
+    return value, tuple(json.loads(tags))
+
+response_cache = ResponseCache()
+
+def _after_commit(session):
+    tables = session.info.pop(COMMITTED_TABLES_KEY, ())
+    if tables:
+        response_cache.invalidate_tags(tables)
+
+def invalidate_on_commit(session):
+    # Drops cached responses that read any table a committed transaction wrote
+    event.listen(session, 'after_commit', _after_commit)
+
+def cached_response(key):
+    # Rebuilds a stored response, or None on a miss
+    value = response_cache.get(key)
+    if value is None:
+        return None
+    headers, body = value.split(b'\n', 1)
+    return Response(body, mimetype='application/json', headers=json.loads(headers))
+
+def cache_response(key, models, response):
+    # Stores a successful, fully buffered JSON response under key, tagged with the tables it read
+    if response.status_code == 200 and not response.is_streamed:
+        headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        value = json.dumps(headers).encode() + b'\n' + response.get_data()
+        response_cache.put(key, value, [model.__table__.name for model in models])
+    return response
+
+def partial_response(response, failed):
+    # A response missing rows that could not be decrypted: flagged to the client with the number left
+    # out, and stored neither here nor by the client, so the first request once decryption works
+    # again gets the full rows
+    response.headers['X-Failed-Rows'] = str(failed)
+    response.cache_control.no_store = True
+    return response
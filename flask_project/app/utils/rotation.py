@@ -0,0 +1,159 @@
+# app/utils/rotation.py
+
+import logging
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_, update
+
+from app import db
+from app.models import Subject
+from .encryption import encrypt_data, decrypt_data, blind_index
+from .grade_cache import grade_cache
+from .keys import get_active_key_id, get_key_ids, get_private_key, get_public_key
+
+logger = logging.getLogger(__name__)
+
+REENCRYPT_BATCH_SIZE = 500
+REENCRYPT_PAUSE = 0.05  # seconds to sleep between batches so live requests keep the database
+
+def _decrypt_any(row):
+    # Rows written before key ids may be under any registered key
+    key_ids = [row.key_id] if row.key_id else get_key_ids()
+    error = None
+    for key_id in key_ids:
+        try:
+            return decrypt_data(row.encrypted_grade, get_private_key(key_id))
+        except Exception as e:
+            error = e
+    raise error
+
+def _read_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    return 0
+
+def _write_checkpoint(path, last_id):
+    if path:
+        with open(path, 'w') as f:
+            f.write(str(last_id))
+
+def reencrypt_subjects(batch_size=REENCRYPT_BATCH_SIZE, pause=REENCRYPT_PAUSE, after_id=0, max_batches=None, checkpoint_path=None):
+    # Walks subject in primary-key order and moves every row not under the active key onto it.
+    # Each batch is committed on its own, so the job can be stopped and resumed from the checkpoint.
+    active_key_id = get_active_key_id()
+    public_key = get_public_key(active_key_id)
+    index_key = current_app.config["BLIND_INDEX_KEY"]
+    stale = or_(Subject.key_id.is_(None), Subject.key_id != active_key_id)
+    result = {"reencrypted": 0, "skipped": 0, "failed": 0, "last_id": after_id}
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = db.session.query(Subject.subject_id, Subject.encrypted_grade, Subject.key_id) \
+            .filter(stale, Subject.subject_id > after_id) \
+            .order_by(Subject.subject_id) \
+            .limit(batch_size) \
+            .all()
+        if not rows:
+            break
+
+        for row in rows:
+            try:
+                grade = _decrypt_any(row).decode('utf-8')
+            except Exception as e:
+                logger.error(f"Error decrypting grade for subject ID {row.subject_id}: {str(e)}")
+                result["failed"] += 1
+                continue
+
+            # Only replace the ciphertext we read, so a concurrent update_user_info always wins
+            updated = db.session.execute(
+                update(Subject)
+                .where(Subject.subject_id == row.subject_id, Subject.encrypted_grade == row.encrypted_grade)
+                .values(
+                    encrypted_grade=encrypt_data(grade, public_key),
+                    key_id=active_key_id,
+                    grade_index=blind_index(grade, index_key)
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if updated.rowcount:
+                grade_cache.invalidate(row.encrypted_grade)
+                result["reencrypted"] += 1
+            else:
+                result["skipped"] += 1
+
+        db.session.commit()
+        after_id = result["last_id"] = rows[-1].subject_id
+        _write_checkpoint(checkpoint_path, after_id)
+        batches += 1
+        logger.info(f"Re-encrypted subjects up to ID {after_id}: {result}")
+
+        if pause:
+            time.sleep(pause)
+
+    return result
+
+def backfill_grade_index(batch_size=REENCRYPT_BATCH_SIZE, pause=REENCRYPT_PAUSE, max_batches=None):
+    # Fills grade_index for rows written before the blind index existed
+    index_key = current_app.config["BLIND_INDEX_KEY"]
+    result = {"indexed": 0, "failed": 0, "last_id": 0}
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = db.session.query(Subject.subject_id, Subject.encrypted_grade, Subject.key_id) \
+            .filter(Subject.grade_index.is_(None), Subject.subject_id > result["last_id"]) \
+            .order_by(Subject.subject_id) \
+            .limit(batch_size) \
+            .all()
+        if not rows:
+            break
+
+        for row in rows:
+            try:
+                grade = _decrypt_any(row).decode('utf-8')
+            except Exception as e:
+                logger.error(f"Error decrypting grade for subject ID {row.subject_id}: {str(e)}")
+                result["failed"] += 1
+                continue
+
+            db.session.execute(
+                update(Subject)
+                .where(Subject.subject_id == row.subject_id, Subject.grade_index.is_(None))
+                .values(grade_index=blind_index(grade, index_key))
+                .execution_options(synchronize_session=False)
+            )
+            result["indexed"] += 1
+
+        db.session.commit()
+        result["last_id"] = rows[-1].subject_id
+        batches += 1
+
+        if pause:
+            time.sleep(pause)
+
+    return result
+
+@click.command('reencrypt-grades')
+@click.option('--batch-size', default=REENCRYPT_BATCH_SIZE, show_default=True, help='Rows per commit.')
+@click.option('--pause', default=REENCRYPT_PAUSE, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--resume/--restart', default=True, help='Continue after the last checkpointed subject ID.')
+@with_appcontext
+def reencrypt_grades_command(batch_size, pause, resume):
+    """Re-encrypt every grade that is not under the active key pair."""
+    checkpoint_path = current_app.config.get('REENCRYPT_CHECKPOINT_PATH')
+    after_id = _read_checkpoint(checkpoint_path) if resume else 0
+    result = reencrypt_subjects(batch_size=batch_size, pause=pause, after_id=after_id, checkpoint_path=checkpoint_path)
+    click.echo(f"Re-encrypted {result['reencrypted']} subjects, skipped {result['skipped']}, failed {result['failed']}")
+
+@click.command('backfill-grade-index')
+@click.option('--batch-size', default=REENCRYPT_BATCH_SIZE, show_default=True, help='Rows per commit.')
+@click.option('--pause', default=REENCRYPT_PAUSE, show_default=True, help='Seconds to sleep between batches.')
+@with_appcontext
+def backfill_grade_index_command(batch_size, pause):
+    """Compute the grade blind index for rows that do not have one yet."""
+    result = backfill_grade_index(batch_size=batch_size, pause=pause)
+    click.echo(f"Indexed {result['indexed']} subjects, failed {result['failed']}")
@@ -0,0 +1,48 @@
+# app/utils/streaming.py
+
+import logging
+
+from flask import Response, request, current_app, stream_with_context
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Rows fetched per server-side cursor round trip, and serialized per chunk written
+STREAM_BATCH_SIZE = 500
+
+def wants_ndjson():
+    # Chosen with ?format=ndjson or an Accept header that prefers NDJSON over JSON
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def stream_ndjson(statement, serialize_batch, batch_size=None):
+    # Streams every row of statement as one JSON object per line. Rows come from a
+    # server-side cursor (yield_per) a batch at a time, so memory stays flat whatever the table size.
+    # serialize_batch returns the items of a batch and the number of its rows it had to leave out.
+    # A stream that fails part way, or left rows out, ends with an {"error": ...} line.
+    batch_size = batch_size or current_app.config.get('STREAM_BATCH_SIZE', STREAM_BATCH_SIZE)
+
+    def generate():
+        result = None
+        failed = 0
+        try:
+            result = db.session.execute(statement.execution_options(yield_per=batch_size))
+            for rows in result.partitions():
+                items, batch_failed = serialize_batch(rows)
+                failed += batch_failed
+                yield ''.join(current_app.json.dumps(item) + '\n' for item in items)
+            if failed:
+                yield current_app.json.dumps({"error": "Some rows could not be read", "failed_rows": failed}) + '\n'
+        except Exception as e:
+            # The 200 status is already sent, so the failure goes in a last line for the client to check
+            logger.error(f"Error streaming rows: {str(e)}")
+            yield current_app.json.dumps({"error": "Failed to stream all rows"}) + '\n'
+        finally:
+            if result is not None:
+                result.close()
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
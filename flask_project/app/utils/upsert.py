@@ -0,0 +1,75 @@
+# app/utils/upsert.py
+
+import unicodedata
+
+from sqlalchemy import and_, func, insert, select
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+
+def _dialect_name():
+    return db.session.get_bind().dialect.name
+
+def insert_ignore_statement(model, key_columns):
+    # INSERT that leaves an existing row alone when it collides on the unique key key_columns
+    table = model.__table__
+    dialect = _dialect_name()
+    if dialect == 'mysql':
+        # No-op assignment: MySQL has no DO NOTHING, and INSERT IGNORE would also swallow FK errors.
+        # Going through LAST_INSERT_ID() makes the statement's insert id the row's key either way.
+        pk = table.primary_key.columns.values()[0]
+        return mysql.insert(table).on_duplicate_key_update({pk.name: func.last_insert_id(pk)})
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=list(key_columns))
+    return insert(table)
+
+def increment_statement(model, key_columns, column, delta):
+    # INSERT of a new counter row that, when one with the same key_columns exists, adds delta to
+    # its column instead; a single statement, so concurrent first writers can't both insert.
+    # None on dialects without an upsert.
+    table = model.__table__
+    dialect = _dialect_name()
+    if dialect == 'mysql':
+        return mysql.insert(table).on_duplicate_key_update({column: table.c[column] + delta})
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_update(
+            index_elements=list(key_columns), set_={column: table.c[column] + delta}
+        )
+    return None
+
+def insert_or_get(model, values, key_columns):
+    # Inserts values unless a row with the same key_columns exists, race-free thanks to the unique
+    # index. Returns (primary key, created).
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    key = and_(*(table.c[column] == values[column] for column in key_columns))
+
+    if _dialect_name() == 'sqlite':
+        # A single statement: rowcount is 0 when DO NOTHING fired
+        result = db.session.execute(insert_ignore_statement(model, key_columns).values(values))
+        if result.rowcount:
+            return result.inserted_primary_key[0], True
+        return db.session.execute(select(pk).where(key)).scalar(), False
+
+    # Elsewhere a plain insert under a savepoint, so a duplicate only fails this statement. MySQL's
+    # upsert can't tell the cases apart: its drivers count found rows, so a no-op update reports
+    # the same rowcount as an insert.
+    try:
+        with db.session.connection().begin_nested():
+            return db.session.execute(insert(table).values(values)).inserted_primary_key[0], True
+    except IntegrityError:
+        # Locking read: the winning row may be newer than this transaction's snapshot
+        existing = db.session.execute(select(pk).where(key).with_for_update(read=True)).scalar()
+        if existing is None:
+            raise  # Not a duplicate: a foreign key or NOT NULL violation
+        return existing, False
+
+def collation_key(value):
+    # A string as the database's default collation compares it, for deduplicating rows in Python
+    # before they reach a unique index. MySQL's utf8mb4 collations ignore case, accents and
+    # (PAD SPACE ones) trailing spaces; SQLite compares bytes.
+    if _dialect_name() != 'mysql':
+        return value
+    decomposed = unicodedata.normalize('NFKD', value.rstrip(' '))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
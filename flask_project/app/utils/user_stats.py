@@ -0,0 +1,65 @@
+# app/utils/user_stats.py
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from app import db
+from app.models import Subject, User
+
+DEFAULT_AGE_BAND = 10
+MAX_AGE_BAND = 100
+# Seconds a computed result is reused; dashboards tolerate this much lag, and it caps how
+# often the GROUP BY scans run no matter how often the tables change. 0 disables it.
+STATS_CACHE_TTL = 30
+
+_cache = {}  # age band -> (result, expires_at)
+_cache_lock = threading.Lock()
+
+def compute_user_stats(age_band=DEFAULT_AGE_BAND):
+    # Every figure is a GROUP BY aggregate in the database; only the small result comes back
+    users_by_gender = dict(db.session.execute(
+        select(User.gender, func.count()).group_by(User.gender)
+    ).all())
+
+    band = (User.age - User.age % age_band).label("band")
+    users_by_age_band = {
+        f"{start}-{start + age_band - 1}": count
+        for start, count in db.session.execute(select(band, func.count()).group_by(band).order_by(band))
+    }
+
+    # Subjects per user, including users with none, then how many users have each count
+    per_user = select(func.count(Subject.subject_id).label("subject_count")) \
+        .select_from(User).outerjoin(Subject, Subject.user_id == User.id) \
+        .group_by(User.id).subquery()
+    subjects_per_user = dict(db.session.execute(
+        select(per_user.c.subject_count, func.count())
+        .group_by(per_user.c.subject_count)
+        .order_by(per_user.c.subject_count)
+    ).all())
+
+    user_count = sum(users_by_gender.values())
+    subject_count = db.session.execute(select(func.count()).select_from(Subject)).scalar()
+    return {
+        "user_count": user_count,
+        "subject_count": subject_count,
+        "users_by_gender": users_by_gender,
+        "users_by_age_band": users_by_age_band,
+        "subjects_per_user": subjects_per_user,
+        "average_subjects_per_user": subject_count / user_count if user_count else 0.0
+    }
+
+def get_user_stats(age_band=DEFAULT_AGE_BAND):
+    ttl = current_app.config.get('STATS_CACHE_TTL', STATS_CACHE_TTL)
+    if ttl:
+        with _cache_lock:
+            entry = _cache.get(age_band)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+    result = compute_user_stats(age_band)
+    if ttl:
+        with _cache_lock:
+            _cache[age_band] = (result, time.monotonic() + ttl)
+    return result
@@ -0,0 +1,67 @@
+import argparse
+import timeit
+
+from sqlalchemy import create_engine, insert, select
+
+from app.models import User, Subject
+from app.schemas import UserSchema, SubjectSchema
+from app.serializers import compile_serializer, row_layout
+
+parser = argparse.ArgumentParser(description="Compare the compiled row serializers with the Marshmallow schemas.")
+parser.add_argument('--rows', type=int, default=10000, help="Rows per serialization.")
+parser.add_argument('--repeat', type=int, default=5, help="Timed runs per serializer; the best one is reported.")
+args = parser.parse_args()
+
+# Real Core rows and ORM objects, from a throwaway in-memory database
+engine = create_engine('sqlite://')
+User.__table__.create(engine)
+Subject.__table__.create(engine)
+with engine.begin() as connection:
+    connection.execute(insert(User), [
+        {"name": f"user{i}", "age": i % 90, "gender": ("male", "female")[i % 2]} for i in range(args.rows)
+    ])
+    connection.execute(insert(Subject), [
+        {"subject_name": f"subject{i}", "encrypted_grade": bytes(64), "key_id": "0" * 16, "user_id": i + 1}
+        for i in range(args.rows)
+    ])
+    user_rows = connection.execute(select(User.id, User.name, User.age, User.gender)).all()
+    subject_rows = connection.execute(
+        select(Subject.subject_id, Subject.subject_name, Subject.encrypted_grade, Subject.key_id, Subject.user_id)
+    ).all()
+
+users = []
+for row in user_rows:
+    user = User(row.name, row.age, row.gender)
+    user.id = row.id
+    users.append(user)
+subjects = []
+for row in subject_rows:
+    subject = Subject(row.subject_name, row.encrypted_grade, row.user_id, row.key_id)
+    subject.subject_id = row.subject_id
+    subjects.append(subject)
+
+user_fields = ('id', 'name', 'age', 'gender')
+subject_fields = ('subject_id', 'subject_name', 'encrypted_grade', 'key_id', 'user_id')
+users_schema = UserSchema(many=True, only=user_fields)
+subjects_schema = SubjectSchema(many=True)
+serialize_user_rows = compile_serializer(user_fields, row_layout(user_rows))
+serialize_users = compile_serializer(user_fields)
+serialize_subject_rows = compile_serializer(subject_fields, row_layout(subject_rows))
+
+def handwritten_users():
+    # The per-row dict building the handlers used before
+    return [{"id": user.id, "name": user.name, "age": user.age, "gender": user.gender} for user in user_rows]
+
+benchmarks = [
+    ("users: marshmallow, ORM objects", lambda: users_schema.dump(users)),
+    ("users: hand-built dicts, Core rows", handwritten_users),
+    ("users: compiled, ORM objects", lambda: serialize_users(users)),
+    ("users: compiled, Core rows", lambda: serialize_user_rows(user_rows)),
+    ("subjects: marshmallow, ORM objects", lambda: subjects_schema.dump(subjects)),
+    ("subjects: compiled, Core rows", lambda: serialize_subject_rows(subject_rows)),
+]
+
+print(f"{args.rows} rows, best of {args.repeat}")
+for name, function in benchmarks:
+    best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+    print(f"{name:40} {best * 1000:9.2f} ms  {args.rows / best:12,.0f} rows/s")
@@ -1,17 +1,39 @@
+import argparse
+import os
+
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.backends import default_backend
 
-# Generate RSA key pair
-private_key = rsa.generate_private_key(
-    public_exponent=65537,
-    key_size=2048,
-    backend=default_backend()
-)
+from app.utils.encryption import CIPHER_SUITES, SUITE_RSA_AES_GCM, generate_keys
+
+parser = argparse.ArgumentParser(description="Generate a key pair for a grade cipher suite.")
+parser.add_argument('--suite', choices=sorted(CIPHER_SUITES), default=SUITE_RSA_AES_GCM,
+                    help="Cipher suite the key pair is for (rsa-oaep and rsa-aes-gcm both use RSA-2048).")
+parser.add_argument('--prefix', default='', help="Prefix for the output file names, e.g. 'x25519_'.")
+parser.add_argument('--force', action='store_true', help="Overwrite existing key files.")
+args = parser.parse_args()
+
+private_key_path = f'{args.prefix}private_key.pem'
+public_key_path = f'{args.prefix}public_key.pem'
+
+# Overwriting a key pair makes every row encrypted under it unreadable
+if not args.force and (os.path.exists(private_key_path) or os.path.exists(public_key_path)):
+    parser.error(f"{private_key_path} or {public_key_path} already exists; use --force to overwrite")
+
+# Generate key pair
+private_key, public_key = generate_keys(args.suite)
+
+# Save the private key to a file
+with open(private_key_path, 'wb') as f:
+    pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    f.write(pem)
 
 # Save the public key to a file
-with open('public_key.pem', 'wb') as f:
-    pem = private_key.public_key().public_bytes(
+with open(public_key_path, 'wb') as f:
+    pem = public_key.public_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PublicFormat.SubjectPublicKeyInfo
     )
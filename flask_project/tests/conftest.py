@@ -0,0 +1,56 @@
+# tests/conftest.py
+
+import pytest
+
+from app import Config, create_app, db
+from app.routes import subjects, users
+from app.utils.encryption import clear_data_keys
+from app.utils.grade_cache import grade_cache
+from app.utils.response_cache import response_cache
+
+API_KEY = {"ApiKey": "kabirhere"}
+PASSTHROUGH_API_KEY = {"ApiKey": "trusted"}
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    # One app per run: create_app registers session hooks and loads the key pair process-wide
+    tmp_path = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'test.db'}")
+        monkeypatch.setattr(Config, "REENCRYPT_CHECKPOINT_PATH", str(tmp_path / "reencrypt.checkpoint"))
+        monkeypatch.setattr(Config, "PASSTHROUGH_API_KEYS", [PASSTHROUGH_API_KEY["ApiKey"]])
+        monkeypatch.setattr(Config, "STATS_CACHE_TTL", 0)
+        application = create_app()
+
+    # The routes are declared on each module's own Flask object, not on the registered blueprints
+    for module in (users, subjects):
+        for rule in module.app.url_map.iter_rules():
+            if rule.endpoint != "static":
+                application.add_url_rule(rule.rule, rule.endpoint, module.app.view_functions[rule.endpoint],
+                                         methods=rule.methods)
+    return application
+
+@pytest.fixture(autouse=True)
+def database(app):
+    # Empty tables and caches for every test
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+    response_cache.clear()
+    grade_cache.clear()
+    clear_data_keys()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def add_user(client, name="Alice", age=30, gender="female"):
+    response = client.post("/add_user_info", json={"name": name, "age": age, "gender": gender}, headers=API_KEY)
+    return response.get_json()["user_id"]
+
+def add_subject(client, user_id, subject_name="Math", grade="A"):
+    response = client.post("/add_subject", json={"subject_name": subject_name, "grade": grade, "user_id": user_id},
+                           headers=API_KEY)
+    return response.get_json()["subject_id"]
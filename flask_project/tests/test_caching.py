@@ -0,0 +1,141 @@
+# tests/test_caching.py
+
+import json
+
+from app import db
+from app.models import Subject, User
+from app.utils import encryption
+from app.utils.etags import table_versions
+from app.utils.grade_cache import GradeCache, grade_cache
+from app.utils.response_cache import ResponseCache, SqliteResponseStore, response_cache
+
+from .conftest import API_KEY, add_subject, add_user
+
+def test_table_version_counts_committed_writes_only(client):
+    start = table_versions(User, Subject)
+    add_user(client, "Alice")
+    add_user(client, "Bob")
+    assert table_versions(User, Subject) == {"user": start["user"] + 2, "subject": start["subject"]}
+
+    db.session.add(User("Carol", 20, "female"))
+    db.session.flush()
+    db.session.rollback()
+    assert table_versions(User)["user"] == start["user"] + 2
+
+def test_conditional_get_until_a_write(client):
+    add_user(client, "Alice")
+    first = client.get("/get_user_info", headers=API_KEY)
+    etag = first.headers["ETag"]
+
+    unchanged = client.get("/get_user_info", headers={**API_KEY, "If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers["ETag"] == etag
+
+    add_user(client, "Bob")
+    changed = client.get("/get_user_info", headers={**API_KEY, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert [user["name"] for user in changed.get_json()] == ["Alice", "Bob"]
+
+def test_etag_depends_on_the_query(client):
+    add_user(client, "Alice")
+    etag = client.get("/get_user_info", headers=API_KEY).headers["ETag"]
+    response = client.get("/get_user_info", query_string={"sort": "name"}, headers={**API_KEY, "If-None-Match": etag})
+    assert response.status_code == 200
+
+def test_post_lookups_are_never_conditional(client):
+    user_id = add_user(client)
+    response = client.post("/get_user_by_id", json={"user_id": user_id}, headers={**API_KEY, "If-None-Match": "*"})
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+
+def test_cached_responses_are_dropped_when_their_tables_change(client):
+    user_id = add_user(client)
+    add_subject(client, user_id, "Math", "A")
+    assert len(client.get("/get_subject_info", headers=API_KEY).get_json()) == 1
+    hits = response_cache.hits
+    assert len(client.get("/get_subject_info", headers=API_KEY).get_json()) == 1
+    assert response_cache.hits == hits + 1
+
+    invalidations = response_cache.invalidations
+    add_subject(client, user_id, "Physics", "B")
+    assert response_cache.invalidations > invalidations
+    assert [subject["subject_name"] for subject in client.get("/get_subject_info", headers=API_KEY).get_json()] == [
+        "Math", "Physics"
+    ]
+
+def test_subject_updates_refresh_user_lookups(client):
+    user_id = add_user(client)
+    subject_id = add_subject(client, user_id, "Math", "A")
+
+    def grades():
+        response = client.post("/get_user_by_id", json={"user_id": user_id}, headers=API_KEY)
+        return [subject["grade"] for subject in response.get_json()["subjects"]]
+
+    assert grades() == ["A"]
+    client.put("/update_user_info", json={"id": user_id, "subjects": [{"subject_id": subject_id, "grade": "C"}]},
+               headers=API_KEY)
+    assert grades() == ["C"]
+
+def test_writes_to_other_tables_keep_cached_responses(client):
+    user_id = add_user(client)
+    client.get("/get_user_info", headers=API_KEY)
+    add_subject(client, user_id)
+    hits = response_cache.hits
+    client.get("/get_user_info", headers=API_KEY)
+    assert response_cache.hits == hits + 1
+
+def test_shared_level_is_invalidated_for_every_process(tmp_path):
+    path = str(tmp_path / "l2.sqlite")
+    writer = ResponseCache(l2=SqliteResponseStore(path))
+    reader = ResponseCache(l2=SqliteResponseStore(path))
+
+    writer.put("key", b"body", ["user"])
+    assert reader.get("key") == b"body"
+    assert reader.l2_hits == 1
+
+    # Gone from the shared level for every process; local copies elsewhere are keyed by the old ETag,
+    # which no request computes once the table version has moved on
+    writer.invalidate_tags(["user"])
+    assert writer.get("key") is None
+    assert ResponseCache(l2=SqliteResponseStore(path)).get("key") is None
+
+def test_grade_cache_is_sized_from_config():
+    cache = GradeCache()
+    cache.configure({"GRADE_CACHE_MAX_ENTRIES": 2, "GRADE_CACHE_TTL": 60})
+    assert (cache.max_entries, cache.ttl) == (2, 60)
+    for grade in (b"A", b"B", b"C"):
+        cache.put(b"ciphertext " + grade, grade)
+    assert cache.stats()["entries"] == 2
+    assert cache.get(b"ciphertext A") is None
+    assert cache.get(b"ciphertext C") == b"C"
+
+def test_responses_missing_undecryptable_rows_are_never_cached(client, monkeypatch):
+    user_id = add_user(client)
+    subject_id = add_subject(client, user_id, "Math", "A")
+    grade_cache.clear()
+
+    def outage(encrypted_data, private_key):
+        raise ConnectionError("Crypto service unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(encryption, "_decrypt", outage)
+        listing = client.get("/get_subject_info", headers=API_KEY)
+        lookup = client.post("/get_user_by_id", json={"user_id": user_id}, headers=API_KEY)
+        by_ids = client.post("/get_subjects_by_ids", json={"subject_ids": [subject_id, 999]}, headers=API_KEY)
+        stream = client.get("/get_subject_info", query_string={"format": "ndjson"}, headers=API_KEY)
+        lines = [json.loads(line) for line in stream.get_data(as_text=True).splitlines()]
+
+    assert listing.status_code == 200
+    assert listing.get_json() == []
+    for response in (listing, lookup, by_ids):
+        assert response.headers["X-Failed-Rows"] == "1"
+        assert response.cache_control.no_store
+        assert "ETag" not in response.headers
+    assert by_ids.get_json() == {"subjects": [], "missing": [999], "failed": [subject_id]}
+    assert lines == [{"error": "Some rows could not be read", "failed_rows": 1}]
+
+    # Decryption works again: nothing from the outage is served
+    assert client.get("/get_subject_info", headers=API_KEY).get_json()[0]["grade"] == "A"
+    lookup = client.post("/get_user_by_id", json={"user_id": user_id}, headers=API_KEY)
+    assert lookup.get_json()["subjects"][0]["grade"] == "A"
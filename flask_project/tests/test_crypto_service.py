@@ -0,0 +1,151 @@
+# tests/test_crypto_service.py
+
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import db
+from app.utils.crypto_service import CryptoServiceClient, CryptoServiceError, RemotePrivateKey
+from app.utils.encryption import decrypt_data, decrypt_many, encrypt_data
+from app.utils.grade_cache import grade_cache
+from app.utils.keys import get_active_key_id, get_public_key
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class Service:
+    # The crypto service in its own process, as deployed, over the test database and key pair
+
+    def __init__(self, socket_path, database_uri, *args):
+        self.socket_path = socket_path
+        self.command = [
+            sys.executable, "-m", "app.utils.crypto_service",
+            "--socket", socket_path, "--database-uri", database_uri, *args
+        ]
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, cwd=PROJECT_DIR, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while True:
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                return
+            except OSError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    raise
+                time.sleep(0.05)
+            finally:
+                probe.close()
+
+    def stop(self):
+        self.process.kill()
+        self.process.wait()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+@pytest.fixture
+def start_service(app, tmp_path_factory):
+    # Unix socket paths are short-lived and length-limited, so each service gets its own short directory
+    services = []
+
+    def start(*args):
+        socket_path = str(tmp_path_factory.mktemp("crypto") / "service.sock")
+        service = Service(socket_path, app.config["SQLALCHEMY_DATABASE_URI"], *args)
+        service.start()
+        services.append(service)
+        return service
+
+    yield start
+    for service in services:
+        if service.process.poll() is None:
+            service.stop()
+
+@pytest.fixture
+def service(start_service):
+    return start_service()
+
+@pytest.fixture
+def crypto_client(service):
+    return CryptoServiceClient(service.socket_path, timeout=5.0)
+
+def encrypt(*grades):
+    # Committed, so the service can read the data key they are wrapped under
+    blobs = [encrypt_data(grade, get_public_key()) for grade in grades]
+    db.session.commit()
+    return blobs
+
+def test_concurrent_callers_get_their_own_results_in_order(crypto_client):
+    key_id = get_active_key_id()
+    grades = [[f"{caller}-{i}" for i in range(20)] for caller in range(8)]
+    requests = [[(blob, key_id) for blob in encrypt(*caller_grades)] for caller_grades in grades]
+
+    with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+        results = list(pool.map(crypto_client.decrypt_many, requests))
+    assert results == [[grade.encode() for grade in caller_grades] for caller_grades in grades]
+
+def test_an_unknown_key_id_fails_only_its_row(crypto_client):
+    first, second = encrypt("A", "B")
+    results = crypto_client.decrypt_many([(first, get_active_key_id()), (second, "0" * 16)])
+    assert results[0] == b"A"
+    assert isinstance(results[1], CryptoServiceError)
+    assert "Unknown key id" in str(results[1])
+
+def test_remote_keys_route_decryption_through_the_service(service, crypto_client):
+    first, second = encrypt("A", "B")
+    known = RemotePrivateKey(crypto_client, get_active_key_id())
+    unknown = RemotePrivateKey(crypto_client, "0" * 16)
+
+    results = decrypt_many([first, second], [known, unknown])
+    assert results[0] == b"A"
+    assert isinstance(results[1], CryptoServiceError)
+    assert decrypt_data(second, known) == b"B"
+
+    # Both plaintexts are cached now, so neither needs the service any more
+    service.stop()
+    assert decrypt_many([first, second], known) == [b"A", b"B"]
+    grade_cache.clear()
+    assert all(isinstance(result, CryptoServiceError) for result in decrypt_many([first, second], known))
+
+def test_callers_fail_while_the_service_is_down_and_reconnect_after(service, crypto_client):
+    (blob,) = encrypt("A")
+    item = (blob, get_active_key_id())
+    assert crypto_client.decrypt_many([item]) == [b"A"]
+
+    service.stop()
+    for _ in range(2):
+        with pytest.raises(CryptoServiceError):
+            crypto_client.decrypt_many([item])
+
+    service.start()
+    assert crypto_client.decrypt_many([item]) == [b"A"]
+
+def test_a_slow_response_times_out_without_confusing_later_calls(start_service):
+    service = start_service("--batch-window", "1.0")
+    (blob,) = encrypt("A")
+    item = (blob, get_active_key_id())
+
+    crypto_client = CryptoServiceClient(service.socket_path, timeout=0.1)
+    with pytest.raises(CryptoServiceError, match="Timed out"):
+        crypto_client.decrypt_many([item])
+
+    # The late response to the abandoned request is dropped, not handed to the next caller
+    crypto_client.timeout = 5.0
+    (other,) = encrypt("B")
+    assert crypto_client.decrypt_many([(other, get_active_key_id())]) == [b"B"]
+
+def test_a_forked_worker_opens_its_own_connection(crypto_client):
+    (blob,) = encrypt("A")
+    item = (blob, get_active_key_id())
+    assert crypto_client.decrypt_many([item]) == [b"A"]
+    inherited = crypto_client._sock
+
+    # What a forked child sees: a connection opened by another process
+    crypto_client._pid = os.getpid() + 1
+    assert crypto_client.decrypt_many([item]) == [b"A"]
+    assert crypto_client._sock is not inherited
@@ -0,0 +1,128 @@
+# tests/test_encryption.py
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app import db
+from app.models import DataKey
+from app.utils.encryption import (
+    CIPHER_SUITES, ENVELOPE_VERSION, HEADER_SIZE, KEY_ID_SIZE, SUITE_RSA_AES_GCM, SUITE_RSA_OAEP,
+    SUITE_X25519_AES_GCM, clear_data_keys, decode_ciphertext, decrypt_data, decrypt_many, encrypt_data,
+    generate_keys, public_key_fingerprint
+)
+from app.utils.grade_cache import grade_cache
+from app.utils.keys import get_private_key
+
+from .conftest import API_KEY, PASSTHROUGH_API_KEY, add_subject, add_user
+
+@pytest.mark.parametrize("suite", sorted(CIPHER_SUITES))
+def test_every_suite_round_trips(suite):
+    private_key, public_key = generate_keys(suite)
+    for grade in ("A", "B+", "Très bien", "x" * 100):
+        assert decrypt_data(encrypt_data(grade, public_key, suite), private_key) == grade.encode()
+
+@pytest.mark.parametrize("suite", sorted(CIPHER_SUITES))
+def test_ciphertexts_are_randomized(suite):
+    _, public_key = generate_keys(suite)
+    assert encrypt_data("A", public_key, suite) != encrypt_data("A", public_key, suite)
+
+def test_envelope_wraps_one_data_key_per_public_key():
+    private_key, public_key = generate_keys(SUITE_RSA_AES_GCM)
+    blobs = [encrypt_data(grade, public_key, SUITE_RSA_AES_GCM) for grade in "ABCDE"]
+    assert all(blob[0] == ENVELOPE_VERSION for blob in blobs)
+    assert DataKey.query.filter_by(public_key_fingerprint=public_key_fingerprint(public_key)).count() == 1
+    assert [decrypt_data(blob, private_key) for blob in blobs] == [grade.encode() for grade in "ABCDE"]
+
+def test_data_keys_are_read_back_from_the_database(client):
+    user_id = add_user(client)
+    add_subject(client, user_id, "Math", "A")
+    # A fresh process (or another host) has nothing cached but the database
+    clear_data_keys()
+    grade_cache.clear()
+    response = client.post("/get_user_by_id", json={"user_id": user_id}, headers=API_KEY)
+    assert response.get_json()["subjects"][0]["grade"] == "A"
+
+def test_processes_share_the_stored_data_key(client):
+    user_id = add_user(client)
+    add_subject(client, user_id, "Math", "A")
+    clear_data_keys()
+    add_subject(client, user_id, "Physics", "B")
+    assert DataKey.query.count() == 1
+
+def test_a_rolled_back_data_key_is_not_reused():
+    _, public_key = generate_keys(SUITE_RSA_AES_GCM)
+    first = encrypt_data("A", public_key, SUITE_RSA_AES_GCM)
+    db.session.rollback()
+    second = encrypt_data("A", public_key, SUITE_RSA_AES_GCM)
+    db.session.commit()
+    assert first[1:1 + KEY_ID_SIZE] != second[1:1 + KEY_ID_SIZE]
+    assert DataKey.query.count() == 1
+    assert encrypt_data("B", public_key, SUITE_RSA_AES_GCM)[1:1 + KEY_ID_SIZE] == second[1:1 + KEY_ID_SIZE]
+
+def test_rsa_key_reads_legacy_oaep_rows():
+    private_key, public_key = generate_keys(SUITE_RSA_AES_GCM)
+    legacy = encrypt_data("C", public_key, SUITE_RSA_OAEP)
+    assert decrypt_data(legacy, private_key) == b"C"
+
+@pytest.mark.parametrize("suite", [SUITE_RSA_AES_GCM, SUITE_X25519_AES_GCM])
+def test_tampered_ciphertext_is_rejected(suite):
+    private_key, public_key = generate_keys(suite)
+    blob = bytearray(encrypt_data("A", public_key, suite))
+    blob[-1] ^= 1
+    with pytest.raises(InvalidTag):
+        decrypt_data(bytes(blob), private_key)
+
+def test_suite_refuses_a_key_of_the_wrong_type():
+    _, x25519_public = generate_keys(SUITE_X25519_AES_GCM)
+    with pytest.raises(ValueError):
+        encrypt_data("A", x25519_public, SUITE_RSA_AES_GCM)
+
+def test_decrypt_many_fails_only_rows_with_unknown_keys():
+    private_key, public_key = generate_keys(SUITE_X25519_AES_GCM)
+    keys = {"good": private_key}
+
+    def resolve(key_id):
+        return keys[key_id]
+
+    # Above DECRYPT_PARALLEL_THRESHOLD, so the pooled path is covered too
+    key_ids = ["good", "missing"] * 40
+    blobs = [encrypt_data(str(i), public_key, SUITE_X25519_AES_GCM) for i in range(len(key_ids))]
+    results = decrypt_many(blobs, resolve, key_ids=key_ids)
+    for i, result in enumerate(results):
+        if key_ids[i] == "good":
+            assert result == str(i).encode()
+        else:
+            assert isinstance(result, KeyError)
+
+def test_passthrough_clients_fetch_each_data_key_once(client):
+    user_id = add_user(client)
+    for subject_name, grade in (("Math", "A"), ("Physics", "B")):
+        add_subject(client, user_id, subject_name, grade)
+    subjects = client.get("/get_subject_info", headers=PASSTHROUGH_API_KEY).get_json()
+    assert set(subjects[0]) == {"subject_id", "subject_name", "encrypted_grade", "key_id"}
+
+    # What a pass-through client does: read the data key ids from the headers, unwrap each key once
+    blobs = [decode_ciphertext(subject["encrypted_grade"]) for subject in subjects]
+    key_ids = sorted({blob[1:1 + KEY_ID_SIZE].hex() for blob in blobs})
+    response = client.get("/get_data_keys", query_string={"ids": ",".join(key_ids)}, headers=PASSTHROUGH_API_KEY)
+    assert response.get_json()["missing"] == []
+    assert response.cache_control.max_age > 0
+    oaep = padding.OAEP(mgf=padding.MGF1(hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+    data_keys = {
+        key_id: AESGCM(get_private_key().decrypt(decode_ciphertext(wrapped_key), oaep))
+        for key_id, wrapped_key in response.get_json()["data_keys"].items()
+    }
+    grades = []
+    for blob in blobs:
+        header, nonce = blob[:1 + KEY_ID_SIZE], blob[1 + KEY_ID_SIZE:HEADER_SIZE]
+        grades.append(data_keys[header[1:].hex()].decrypt(nonce, blob[HEADER_SIZE:], header))
+    assert grades == [b"A", b"B"]
+
+def test_data_keys_are_only_served_to_passthrough_clients(client):
+    assert client.get("/get_data_keys", query_string={"ids": "00" * KEY_ID_SIZE}, headers=API_KEY).status_code == 403
+    response = client.get("/get_data_keys", query_string={"ids": "00" * KEY_ID_SIZE}, headers=PASSTHROUGH_API_KEY)
+    assert response.get_json() == {"data_keys": {}, "missing": ["00" * KEY_ID_SIZE]}
+    assert client.get("/get_data_keys", query_string={"ids": "zz"}, headers=PASSTHROUGH_API_KEY).status_code == 400
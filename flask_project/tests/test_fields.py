@@ -0,0 +1,73 @@
+# tests/test_fields.py
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.utils import encryption
+from app.utils.grade_cache import grade_cache
+
+from .conftest import API_KEY, add_subject, add_user
+
+@pytest.fixture
+def user_id(client):
+    user_id = add_user(client, "Alice", 30, "female")
+    add_subject(client, user_id, "Math", "A")
+    add_subject(client, user_id, "Physics", "B")
+    return user_id
+
+@pytest.fixture
+def statements(monkeypatch):
+    # SQL run by the request, and a guard that fails any grade decryption
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def no_decryption(encrypted_data, private_key):
+        raise AssertionError("Grade decrypted although it was not requested")
+
+    grade_cache.clear()
+    monkeypatch.setattr(encryption, "_decrypt", no_decryption)
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", record)
+
+def test_user_lookup_narrows_the_user_and_subject_columns(client, user_id, statements):
+    response = client.post("/get_user_by_id", query_string={"fields": "name,subjects.subject_name"},
+                           json={"user_id": user_id}, headers=API_KEY)
+    assert response.get_json() == {"name": "Alice", "subjects": [{"subject_name": "Math"}, {"subject_name": "Physics"}]}
+    assert not any("encrypted_grade" in statement for statement in statements)
+
+def test_user_lookup_without_subjects_does_not_query_them(client, user_id, statements):
+    response = client.post("/get_user_by_id", query_string={"fields": "id,age"}, json={"user_id": user_id},
+                           headers=API_KEY)
+    assert response.get_json() == {"id": user_id, "age": 30}
+    assert not any("subject" in statement for statement in statements)
+
+def test_user_lookup_returns_every_subject_field_for_subjects(client, user_id):
+    response = client.post("/get_user_by_id", query_string={"fields": "name,subjects"}, json={"user_id": user_id},
+                           headers=API_KEY)
+    assert [subject["grade"] for subject in response.get_json()["subjects"]] == ["A", "B"]
+    assert set(response.get_json()) == {"name", "subjects"}
+
+def test_multi_gets_narrow_their_columns(client, user_id, statements):
+    users = client.post("/get_users_by_ids", query_string={"fields": "name,subjects.subject_name"},
+                        json={"user_ids": [user_id, 999]}, headers=API_KEY).get_json()
+    assert users == {
+        "users": [{"name": "Alice", "subjects": [{"subject_name": "Math"}, {"subject_name": "Physics"}]}],
+        "missing": [999]
+    }
+
+    subjects = client.post("/get_subjects_by_ids", query_string={"fields": "subject_name"},
+                           json={"subject_ids": [2, 1, 999]}, headers=API_KEY).get_json()
+    assert subjects == {
+        "subjects": [{"subject_name": "Physics"}, {"subject_name": "Math"}], "missing": [999], "failed": []
+    }
+    assert not any("encrypted_grade" in statement for statement in statements)
+
+def test_unknown_fields_are_rejected(client, user_id):
+    for path, body in (("/get_user_by_id", {"user_id": user_id}), ("/get_users_by_ids", {"user_ids": [user_id]}),
+                       ("/get_subjects_by_ids", {"subject_ids": [1]})):
+        response = client.post(path, query_string={"fields": "name,subjects.age"}, json=body, headers=API_KEY)
+        assert response.status_code == 400
@@ -0,0 +1,27 @@
+# tests/test_grade_stats.py
+
+from sqlalchemy import update
+
+from app import db
+from app.models import Subject
+from app.utils.grade_stats import rebuild_grade_stats
+
+from .conftest import API_KEY, add_subject, add_user
+
+def grade_stats(client):
+    return client.get("/get_grade_stats", headers=API_KEY).get_json()
+
+def test_rebuild_indexes_legacy_rows_so_updates_move_their_count(client):
+    user_id = add_user(client)
+    subject_id = add_subject(client, user_id, "Math", "A")
+    # A row written before the blind index existed
+    db.session.execute(update(Subject).values(grade_index=None))
+    db.session.commit()
+
+    rebuild_grade_stats()
+    assert db.session.get(Subject, subject_id).grade_index is not None
+    assert grade_stats(client) == {"Math": {"A": 1}}
+
+    client.put("/update_user_info", json={"id": user_id, "subjects": [{"subject_id": subject_id, "grade": "B"}]},
+               headers=API_KEY)
+    assert grade_stats(client) == {"Math": {"B": 1}}
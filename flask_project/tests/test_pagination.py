@@ -0,0 +1,78 @@
+# tests/test_pagination.py
+
+import pytest
+
+from .conftest import API_KEY, add_subject, add_user
+
+NAMES = ["Cleo", "ann", "Bob", "Ann", "Dan"]
+
+@pytest.fixture
+def users(client):
+    # Repeated names and ages, so the id tie-breaker matters for every sort
+    items = [
+        {"name": NAMES[i % len(NAMES)], "age": 20 + i * 7 % 9, "gender": ("male", "female")[i % 2]}
+        for i in range(23)
+    ]
+    response = client.post("/add_users_bulk", json={"users": items}, headers=API_KEY)
+    ids = [result["user_id"] for result in response.get_json()["results"]]
+    return [dict(item, id=user_id) for item, user_id in zip(items, ids)]
+
+def fetch_all(client, path, limit, **params):
+    # Follows X-Next-Cursor until the last page; returns the pages
+    pages = []
+    after = None
+    while True:
+        query = {**params, "limit": limit, **({"after": after} if after else {})}
+        response = client.get(path, query_string=query, headers=API_KEY)
+        assert response.status_code == 200, response.get_json()
+        pages.append(response.get_json())
+        after = response.headers.get("X-Next-Cursor")
+        if not after:
+            return pages
+
+@pytest.mark.parametrize("sort", ["id", "-id", "name", "-name", "age", "-age"])
+@pytest.mark.parametrize("limit", [1, 4, 23, 100])
+def test_pages_cover_every_user_once_in_order(client, users, sort, limit):
+    key = sort.lstrip("-")
+    expected = sorted(users, key=lambda user: (user[key], user["id"]), reverse=sort.startswith("-"))
+    pages = fetch_all(client, "/get_user_info", limit, sort=sort)
+    assert all(len(page) <= limit for page in pages)
+    assert [user["id"] for page in pages for user in page] == [user["id"] for user in expected]
+
+def test_pages_respect_filters(client, users):
+    pages = fetch_all(client, "/get_user_info", 2, sort="-age", gender="female", min_age=21)
+    expected = sorted(
+        (user for user in users if user["gender"] == "female" and user["age"] >= 21),
+        key=lambda user: (user["age"], user["id"]), reverse=True
+    )
+    assert [user["id"] for page in pages for user in page] == [user["id"] for user in expected]
+
+def test_rows_added_between_pages_are_not_repeated_or_skipped(client, users):
+    first = client.get("/get_user_info", query_string={"sort": "name", "limit": 5}, headers=API_KEY)
+    seen = [user["id"] for user in first.get_json()]
+    # Sorts before every name on the first page, so it must not appear later
+    add_user(client, name="AAA")
+    rest = client.get("/get_user_info", query_string={"sort": "name", "limit": 100,
+                                                      "after": first.headers["X-Next-Cursor"]}, headers=API_KEY)
+    seen += [user["id"] for user in rest.get_json()]
+    assert sorted(seen) == sorted(user["id"] for user in users)
+
+def test_cursor_is_bound_to_its_sort_order(client, users):
+    response = client.get("/get_user_info", query_string={"sort": "name", "limit": 2}, headers=API_KEY)
+    cursor = response.headers["X-Next-Cursor"]
+    for sort in ("age", "-name", "id"):
+        response = client.get("/get_user_info", query_string={"sort": sort, "after": cursor}, headers=API_KEY)
+        assert response.status_code == 400
+
+def test_tampered_cursor_is_rejected(client, users):
+    response = client.get("/get_user_info", query_string={"limit": 2}, headers=API_KEY)
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/get_user_info", query_string={"after": cursor[:-2] + "xx"}, headers=API_KEY)
+    assert response.status_code == 400
+
+def test_subject_pages_cover_every_subject_once(client):
+    user_id = add_user(client)
+    subject_ids = [add_subject(client, user_id, f"Subject {i}", "B") for i in range(7)]
+    pages = fetch_all(client, "/get_subject_info", 3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [subject["subject_id"] for page in pages for subject in page] == subject_ids
@@ -0,0 +1,65 @@
+# tests/test_rotation.py
+
+import pytest
+
+from app import db
+from app.models import Subject
+from app.utils import keys
+from app.utils.encryption import generate_keys
+from app.utils.rotation import _read_checkpoint, reencrypt_grades_command, reencrypt_subjects
+
+from .conftest import API_KEY, add_subject, add_user
+
+@pytest.fixture
+def grades(client):
+    user_id = add_user(client)
+    return {add_subject(client, user_id, f"Subject {i}", grade): grade for i, grade in enumerate("ABCDE")}
+
+@pytest.fixture
+def new_key_id(monkeypatch):
+    # Rotate: register a fresh pair and make it the active one; the old pair stays registered for reads
+    key_id = keys.register_key_pair(*generate_keys())
+    monkeypatch.setattr(keys, "_active_key_id", key_id)
+    return key_id
+
+def key_ids():
+    return dict(db.session.execute(db.select(Subject.subject_id, Subject.key_id)).all())
+
+def read_grades(client):
+    response = client.get("/get_subject_info", headers=API_KEY)
+    return {subject["subject_id"]: subject["grade"] for subject in response.get_json()}
+
+def test_reencrypt_moves_every_row_to_the_active_key(client, grades, new_key_id):
+    result = reencrypt_subjects(batch_size=2, pause=0)
+    assert result["reencrypted"] == len(grades)
+    assert set(key_ids().values()) == {new_key_id}
+    assert read_grades(client) == grades
+    # Nothing left to do on a second run
+    assert reencrypt_subjects(batch_size=2, pause=0)["reencrypted"] == 0
+
+def test_reencrypt_resumes_from_its_checkpoint(client, grades, new_key_id, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint")
+    first = reencrypt_subjects(batch_size=2, pause=0, max_batches=1, checkpoint_path=checkpoint_path)
+    assert first["reencrypted"] == 2
+    assert _read_checkpoint(checkpoint_path) == first["last_id"]
+
+    second = reencrypt_subjects(batch_size=2, pause=0, after_id=_read_checkpoint(checkpoint_path),
+                                checkpoint_path=checkpoint_path)
+    assert second["reencrypted"] == len(grades) - 2
+    assert _read_checkpoint(checkpoint_path) == max(grades)
+    assert set(key_ids().values()) == {new_key_id}
+    assert read_grades(client) == grades
+
+def test_reencrypt_command_skips_rows_before_the_checkpoint(app, client, grades, new_key_id):
+    old_key_id = key_ids()[min(grades)]
+    checkpointed = sorted(grades)[:3]
+    with open(app.config["REENCRYPT_CHECKPOINT_PATH"], "w") as f:
+        f.write(str(checkpointed[-1]))
+
+    result = app.test_cli_runner().invoke(reencrypt_grades_command, ["--batch-size", "2", "--pause", "0"])
+    assert result.exit_code == 0, result.output
+    assert "Re-encrypted 2 subjects" in result.output
+    assert key_ids() == {
+        subject_id: old_key_id if subject_id in checkpointed else new_key_id for subject_id in grades
+    }
+    assert read_grades(client) == grades
@@ -0,0 +1,130 @@
+# tests/test_upsert.py
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Subject, SubjectGradeStat, User
+from app.routes.users import USER_KEY_COLUMNS
+from app.utils import upsert
+from app.utils.etags import table_versions
+from app.utils.upsert import collation_key, insert_or_get
+
+from .conftest import API_KEY, add_subject, add_user
+
+def count(model):
+    return db.session.scalar(db.select(db.func.count()).select_from(model))
+
+def test_add_user_is_idempotent(client):
+    first = client.post("/add_user_info", json={"name": "Alice", "age": 30, "gender": "female"}, headers=API_KEY)
+    second = client.post("/add_user_info", json={"name": "Alice", "age": 30, "gender": "female"}, headers=API_KEY)
+    assert second.get_json() == {"message": "User data already exists", "user_id": first.get_json()["user_id"]}
+    assert count(User) == 1
+
+def test_add_subject_is_idempotent_and_counted_once(client):
+    user_id = add_user(client)
+    body = {"subject_name": "Math", "grade": "A", "user_id": user_id}
+    first = client.post("/add_subject", json=body, headers=API_KEY).get_json()
+    second = client.post("/add_subject", json=body, headers=API_KEY).get_json()
+    assert second == {"message": "Subject already exists for this user", "subject_id": first["subject_id"]}
+    assert count(Subject) == 1
+    assert client.get("/get_grade_stats", headers=API_KEY).get_json() == {"Math": {"A": 1}}
+
+def test_bulk_ingestion_is_idempotent(client):
+    items = [
+        {"name": "Alice", "age": 30, "gender": "female"},
+        {"name": "Bob", "age": 41, "gender": "male"},
+        {"name": "Alice", "age": 30, "gender": "female"},
+        {"name": "Bob", "age": 41},
+    ]
+    first = client.post("/add_users_bulk", json={"users": items}, headers=API_KEY).get_json()["results"]
+    assert [result.get("status") for result in first] == ["created", "created", "created", None]
+    assert first[0]["user_id"] == first[2]["user_id"]
+    assert "error" in first[3]
+
+    second = client.post("/add_users_bulk", json={"users": items[:3]}, headers=API_KEY).get_json()["results"]
+    assert [result["status"] for result in second] == ["exists"] * 3
+    assert [result["user_id"] for result in second] == [result["user_id"] for result in first[:3]]
+    assert count(User) == 2
+
+@pytest.mark.parametrize("dialect", ["sqlite", "postgresql"])
+def test_insert_or_get_creates_once(dialect, monkeypatch):
+    # Dialects other than SQLite take the savepoint path, which runs on SQLite too
+    monkeypatch.setattr(upsert, "_dialect_name", lambda: dialect)
+    values = {"name": "Carol", "age": 25, "gender": "female"}
+    user_id, created = insert_or_get(User, values, USER_KEY_COLUMNS)
+    assert created
+    assert insert_or_get(User, values, USER_KEY_COLUMNS) == (user_id, False)
+    db.session.commit()
+    assert count(User) == 1
+
+def test_insert_or_get_keeps_the_transaction_usable_after_a_duplicate(monkeypatch):
+    monkeypatch.setattr(upsert, "_dialect_name", lambda: "postgresql")
+    db.session.add(User("Dave", 50, "male"))
+    db.session.flush()
+    assert insert_or_get(User, {"name": "Dave", "age": 50, "gender": "male"}, USER_KEY_COLUMNS)[1] is False
+    db.session.add(User("Erin", 22, "female"))
+    db.session.commit()
+    assert count(User) == 2
+
+def test_insert_or_get_raises_errors_other_than_duplicates(monkeypatch):
+    monkeypatch.setattr(upsert, "_dialect_name", lambda: "postgresql")
+    with pytest.raises(IntegrityError):
+        insert_or_get(User, {"name": "Frank", "age": 33, "gender": None}, USER_KEY_COLUMNS)
+
+def test_grade_counters_accumulate_through_the_upsert(client):
+    user_id = add_user(client)
+    for subject_name in ("Math", "Physics", "Art"):
+        client.post("/add_subject", json={"subject_name": subject_name, "grade": "B", "user_id": user_id},
+                    headers=API_KEY)
+    assert client.get("/get_grade_stats", query_string={"user_id": user_id}, headers=API_KEY).get_json() == {
+        "user_id": user_id, "subject_count": 3, "grades": {"B": 3}
+    }
+    assert count(SubjectGradeStat) == 3
+
+def test_collation_key_matches_mysql_comparison(monkeypatch):
+    monkeypatch.setattr(upsert, "_dialect_name", lambda: "mysql")
+    assert collation_key("Zoë ") == collation_key("ZOE") == collation_key("zoe")
+    assert collation_key("Zoe") != collation_key("Zoey")
+    monkeypatch.setattr(upsert, "_dialect_name", lambda: "sqlite")
+    assert collation_key("Zoë ") == "Zoë "
+
+def test_updates_colliding_with_a_unique_index_are_conflicts(client):
+    alice = add_user(client, "Alice", 30, "female")
+    carol = add_user(client, "Carol", 30, "female")
+    response = client.put("/update_user_info", json={"id": carol, "name": "Alice"}, headers=API_KEY)
+    assert response.status_code == 409
+    assert "SQL" not in response.get_json()["error"]
+
+    math = add_subject(client, alice, "Math", "A")
+    physics = add_subject(client, alice, "Physics", "B")
+    rename = {"id": alice, "subjects": [{"subject_id": physics, "subject_name": "Math"}]}
+    response = client.put("/update_user_info", json=rename, headers=API_KEY)
+    assert response.status_code == 409
+
+    # Nothing was written, and the session is usable again
+    assert [user["name"] for user in client.get("/get_user_info", headers=API_KEY).get_json()] == ["Alice", "Carol"]
+    assert client.get("/get_grade_stats", headers=API_KEY).get_json() == {"Math": {"A": 1}, "Physics": {"B": 1}}
+    response = client.put("/update_user_info", json={"id": alice, "subjects": [{"subject_id": math, "grade": "C"}]},
+                          headers=API_KEY)
+    assert response.status_code == 200
+
+def test_repeating_an_update_writes_nothing(client):
+    user_id = add_user(client, "Alice", 30, "female")
+    subject_id = add_subject(client, user_id, "Math", "A")
+    update = {"id": user_id, "name": "Alicia", "age": 31, "subjects": [
+        {"subject_id": subject_id, "subject_name": "Maths", "grade": "B"}
+    ]}
+
+    first = client.put("/update_user_info", json=update, headers=API_KEY).get_json()
+    assert first["no_op"] is False
+    versions = table_versions(User, Subject)
+    stored = db.session.get(Subject, subject_id).encrypted_grade
+
+    # The retry matches what is stored; the grade is compared through its blind index, not by decrypting
+    second = client.put("/update_user_info", json=update, headers=API_KEY).get_json()
+    assert second == {"message": "User data unchanged", "user_id": user_id, "no_op": True}
+    assert table_versions(User, Subject) == versions
+    db.session.expire_all()
+    assert db.session.get(Subject, subject_id).encrypted_grade == stored
+    assert client.get("/get_grade_stats", headers=API_KEY).get_json() == {"Maths": {"B": 1}}